@@ -4,21 +4,87 @@
 """
 
 import json
-import base64
+import binascii
 import re
+import os
+import sys
 import asyncio
 import aiohttp
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from urllib.parse import urlparse, parse_qs, unquote
-from dataclasses import dataclass, asdict
-from typing import Optional
+from urllib.parse import unquote, unquote_plus
+from dataclasses import dataclass, field, fields
+from typing import AsyncIterator, Iterator, Optional
 import yaml
+from yaml.events import (
+    AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent,
+    SequenceEndEvent, SequenceStartEvent
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
 import hashlib
+import ipaddress
+import socket
+import time
 
+from artifacts import NDJSONWriter, RAW_NODES_PATH
 
-@dataclass
+try:
+    # 優先使用 libyaml C 實作
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+
+# 同一端點的不同編碼視為同一節點 (vmess / vless 共用 UUID 身份)
+PROTOCOL_FAMILY = {
+    "vmess": "v2ray",
+    "vless": "v2ray",
+}
+
+
+def canonical_host(host: str) -> str:
+    """正規化主機名：小寫、去除結尾的點與 IPv6 方括號，IP 使用標準寫法"""
+    host = host.strip().strip("[]").rstrip(".").lower()
+    # 合法的 IPv4 點分寫法本身就是標準寫法 (不接受前導零)，只有 IPv6 需要改寫
+    if ":" not in host:
+        return host
+    try:
+        compressed = socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, host))
+        if "." not in compressed:
+            return compressed
+    except OSError:
+        pass
+    # 帶 scope 或內嵌 IPv4 的寫法由 ipaddress 處理 (inet_ntop 的輸出格式不同)
+    try:
+        return ipaddress.ip_address(host).compressed
+    except ValueError:
+        return host
+
+
+def canonical_identity(protocol: str, address: str, port, credential: str) -> str:
+    """節點的正規化身份字串"""
+    family = PROTOCOL_FAMILY.get(protocol, protocol)
+    if family == "v2ray":
+        credential = credential.strip().lower()
+    elif protocol == "ss" and ":" in credential:
+        method, password = credential.split(":", 1)
+        credential = f"{method.lower()}:{password}"
+    return f"{family}|{canonical_host(str(address))}|{port}|{credential}"
+
+
+def identity_hash(identity: str) -> str:
+    """身份字串的 64 位 BLAKE2b 雜湊 (16 個十六進位字元)"""
+    return hashlib.blake2b(identity.encode(), digest_size=8).hexdigest()
+
+
+_setattr = object.__setattr__
+
+
+@dataclass(frozen=True, slots=True)
 class ProxyNode:
-    """代理節點資料結構"""
+    """代理節點資料結構 (不可變，使用 __slots__ 節省記憶體)"""
     protocol: str  # vmess, vless, trojan, ss, ssr
     address: str
     port: int
@@ -31,364 +97,964 @@ class ProxyNode:
     host: str = ""
     source: str = ""
     priority: int = 99
+    _uid: str = field(default="", init=False, repr=False, compare=False)
+    
+    # 低基數欄位：駐留字串，相同值共用同一物件
+    INTERNED = ("protocol", "network", "source", "sni")
+    
+    def _intern_fields(self):
+        # 常見值 (協議名、"tcp"、來源名) 多半已是駐留的字面值，只有新字串才寫回
+        for name in self.INTERNED:
+            value = getattr(self, name)
+            if type(value) is str:
+                interned = sys.intern(value)
+                if interned is not value:
+                    _setattr(self, name, interned)
+    
+    def __post_init__(self):
+        self._intern_fields()
+        identity = canonical_identity(self.protocol, self.address, self.port, self.uuid_or_password)
+        _setattr(self, "_uid", identity_hash(identity))
     
     @property
     def unique_id(self) -> str:
-        """生成唯一 ID 用於去重"""
-        key = f"{self.protocol}:{self.address}:{self.port}:{self.uuid_or_password}"
-        return hashlib.md5(key.encode()).hexdigest()[:12]
+        """唯一 ID 用於去重 (依正規化身份，建立時計算一次)"""
+        return self._uid
+    
+    def with_source(self, source: str, priority: int) -> "ProxyNode":
+        """返回設定了來源資訊的副本"""
+        if source == self.source and priority == self.priority:
+            return self
+        # 身份欄位不變，沿用 _uid，不再經過 __post_init__
+        node = object.__new__(ProxyNode)
+        for name in NODE_SLOTS:
+            _setattr(node, name, getattr(self, name))
+        _setattr(node, "source", sys.intern(source))
+        _setattr(node, "priority", priority)
+        return node
+    
+    def _set_source(self, source: str, priority: int):
+        """就地設定來源資訊；只用於剛建立、尚未放入集合或交給其他程式碼的節點"""
+        _setattr(self, "source", sys.intern(source))
+        _setattr(self, "priority", priority)
+    
+    def to_tuple(self) -> tuple:
+        """精簡表示 (欄位值與 unique_id)，用於跨進程傳遞"""
+        return tuple([getattr(self, name) for name in NODE_SLOTS])
+    
+    @classmethod
+    def restore(cls, values) -> "ProxyNode":
+        """從 to_tuple() 的結果還原，直接使用其中的 unique_id，不重新正規化與雜湊"""
+        node = object.__new__(cls)
+        for name, value in zip(NODE_SLOTS, values):
+            _setattr(node, name, value)
+        # 跨進程傳回的字串不是駐留的
+        node._intern_fields()
+        return node
+    
+    def to_dict(self) -> dict:
+        """轉換為可序列化的 dict"""
+        data = {name: getattr(self, name) for name in NODE_FIELDS}
+        data["unique_id"] = self._uid
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "ProxyNode":
+        """從 dict 還原節點，忽略未知欄位"""
+        return cls(**{name: data[name] for name in NODE_FIELDS if name in data})
+
+
+NODE_FIELDS = tuple(f.name for f in fields(ProxyNode) if f.init)
+NODE_SLOTS = NODE_FIELDS + ("_uid",)
+
+
+_URLSAFE = str.maketrans("-_", "+/")
+_QUERY_KEYS = frozenset(("type", "security", "sni", "path", "host"))
+
+
+def b64decode(data: str) -> Optional[bytes]:
+    """共用 base64 解碼：自動補齊 padding、接受 urlsafe 字元，失敗返回 None"""
+    data = data.strip().translate(_URLSAFE)
+    remainder = len(data) % 4
+    if remainder == 1:
+        return None
+    if remainder:
+        data += "=" * (4 - remainder)
+    try:
+        return binascii.a2b_base64(data)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _parse_port(value) -> Optional[int]:
+    """驗證埠號，無效時返回 None"""
+    if type(value) is int:
+        port = value
+    else:
+        value = str(value).strip()
+        if not value.isdigit():
+            return None
+        port = int(value)
+    return port if 0 < port < 65536 else None
+
+
+def _split_host_port(hostport: str, default_port: int = 443) -> tuple[str, Optional[int]]:
+    """拆分 host:port，支援 [IPv6]:port"""
+    if hostport.startswith("["):
+        end = hostport.find("]")
+        if end < 0:
+            return "", None
+        host, rest = hostport[1:end], hostport[end + 1:]
+        if not rest:
+            return host, default_port
+        if rest[0] != ":":
+            return "", None
+        return host, _parse_port(rest[1:])
+    host, sep, port = hostport.rpartition(":")
+    if not sep:
+        return hostport, default_port
+    return host, _parse_port(port)
+
+
+def _parse_query(query: str) -> dict[str, str]:
+    """只提取需要的查詢參數，同名參數取第一個，空值忽略"""
+    params = {}
+    if not query:
+        return params
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        if value and key in _QUERY_KEYS and key not in params:
+            params[key] = unquote_plus(value) if "%" in value or "+" in value else value
+    return params
 
 
 class NodeParser:
-    """節點解析器"""
+    """節點解析器 - 依 scheme 查表分派，無效行以廉價檢查提前拒絕"""
     
     @staticmethod
-    def parse_vmess(uri: str) -> Optional[ProxyNode]:
-        """解析 vmess:// 連結"""
+    def parse_vmess(body: str) -> Optional[ProxyNode]:
+        """解析 vmess:// 之後的內容 (base64 JSON)"""
+        decoded = b64decode(body)
+        if not decoded or decoded.lstrip()[:1] != b"{":
+            return None
         try:
-            encoded = uri.replace("vmess://", "")
-            # 補齊 base64 padding
-            padding = 4 - len(encoded) % 4
-            if padding != 4:
-                encoded += "=" * padding
-            decoded = base64.b64decode(encoded).decode('utf-8')
             config = json.loads(decoded)
-            
-            return ProxyNode(
-                protocol="vmess",
-                address=config.get("add", ""),
-                port=int(config.get("port", 443)),
-                uuid_or_password=config.get("id", ""),
-                name=config.get("ps", ""),
-                network=config.get("net", "tcp"),
-                tls=config.get("tls", "") == "tls",
-                sni=config.get("sni", ""),
-                path=config.get("path", ""),
-                host=config.get("host", "")
-            )
-        except Exception as e:
+        except ValueError:
+            return None
+        if type(config) is not dict:
             return None
+        
+        port = _parse_port(config.get("port", 443))
+        if port is None:
+            return None
+        
+        return ProxyNode(
+            protocol="vmess",
+            address=str(config.get("add", "")),
+            port=port,
+            uuid_or_password=str(config.get("id", "")),
+            name=str(config.get("ps", "")),
+            network=config.get("net", "tcp"),
+            tls=config.get("tls", "") == "tls",
+            sni=config.get("sni", ""),
+            path=config.get("path", ""),
+            host=config.get("host", "")
+        )
     
     @staticmethod
-    def parse_vless(uri: str) -> Optional[ProxyNode]:
-        """解析 vless:// 連結"""
-        try:
-            parsed = urlparse(uri)
-            params = parse_qs(parsed.query)
-            
-            # 提取 fragment 作為名稱
-            name = unquote(parsed.fragment) if parsed.fragment else ""
-            
-            return ProxyNode(
-                protocol="vless",
-                address=parsed.hostname or "",
-                port=parsed.port or 443,
-                uuid_or_password=parsed.username or "",
-                name=name,
-                network=params.get("type", ["tcp"])[0],
-                tls=params.get("security", ["none"])[0] in ["tls", "reality"],
-                sni=params.get("sni", [""])[0],
-                path=params.get("path", [""])[0],
-                host=params.get("host", [""])[0]
-            )
-        except Exception:
+    def _parse_userinfo_uri(protocol: str, body: str) -> Optional[ProxyNode]:
+        """解析 credential@host:port?query#name 形式 (vless / trojan)"""
+        body, _, fragment = body.partition("#")
+        body, _, query = body.partition("?")
+        userinfo, at, hostport = body.rpartition("@")
+        if not at or not userinfo:
+            return None
+        credential = userinfo.partition(":")[0]
+        if not credential:
+            return None
+        host, port = _split_host_port(hostport.rstrip("/"))
+        if not host or port is None:
             return None
+        
+        params = _parse_query(query)
+        if protocol == "trojan":
+            tls = True
+        else:
+            tls = params.get("security", "none") in ("tls", "reality")
+        
+        return ProxyNode(
+            protocol=protocol,
+            address=host.lower(),
+            port=port,
+            uuid_or_password=credential,
+            name=unquote(fragment) if fragment else "",
+            network=params.get("type", "tcp"),
+            tls=tls,
+            sni=params.get("sni", ""),
+            path=params.get("path", ""),
+            host=params.get("host", "")
+        )
     
     @staticmethod
-    def parse_trojan(uri: str) -> Optional[ProxyNode]:
-        """解析 trojan:// 連結"""
-        try:
-            parsed = urlparse(uri)
-            params = parse_qs(parsed.query)
-            name = unquote(parsed.fragment) if parsed.fragment else ""
-            
-            return ProxyNode(
-                protocol="trojan",
-                address=parsed.hostname or "",
-                port=parsed.port or 443,
-                uuid_or_password=parsed.username or "",
-                name=name,
-                network=params.get("type", ["tcp"])[0],
-                tls=True,
-                sni=params.get("sni", [""])[0],
-                path=params.get("path", [""])[0],
-                host=params.get("host", [""])[0]
-            )
-        except Exception:
-            return None
+    def parse_vless(body: str) -> Optional[ProxyNode]:
+        """解析 vless:// 之後的內容"""
+        return NodeParser._parse_userinfo_uri("vless", body)
     
     @staticmethod
-    def parse_ss(uri: str) -> Optional[ProxyNode]:
-        """解析 ss:// 連結 (Shadowsocks)"""
-        try:
-            uri = uri.replace("ss://", "")
-            
-            # 分離 fragment (名稱)
-            if "#" in uri:
-                uri, name = uri.rsplit("#", 1)
-                name = unquote(name)
+    def parse_trojan(body: str) -> Optional[ProxyNode]:
+        """解析 trojan:// 之後的內容"""
+        return NodeParser._parse_userinfo_uri("trojan", body)
+    
+    @staticmethod
+    def parse_ss(body: str) -> Optional[ProxyNode]:
+        """解析 ss:// 之後的內容 (Shadowsocks)"""
+        # 分離 fragment (名稱)
+        body, _, name = body.partition("#")
+        name = unquote(name) if name else ""
+        
+        if "@" in body:
+            # SIP002 格式: base64(method:password)@host:port[/?plugin]
+            user_info, _, server_info = body.rpartition("@")
+            plain = unquote(user_info)
+            if ":" in plain:
+                method, _, password = plain.partition(":")
             else:
-                name = ""
-            
-            # SIP002 格式: base64(method:password)@host:port
-            if "@" in uri:
-                user_info, server_info = uri.rsplit("@", 1)
-                # 補齊 padding
-                padding = 4 - len(user_info) % 4
-                if padding != 4:
-                    user_info += "=" * padding
-                try:
-                    decoded = base64.b64decode(user_info).decode('utf-8')
-                    method, password = decoded.split(":", 1)
-                except:
-                    method, password = user_info, ""
-                
-                if ":" in server_info:
-                    host, port = server_info.rsplit(":", 1)
+                decoded = b64decode(user_info)
+                text = decoded.decode('utf-8', 'replace') if decoded else ""
+                if ":" in text:
+                    method, _, password = text.partition(":")
                 else:
-                    host, port = server_info, "443"
-            else:
-                # 舊格式: base64(method:password@host:port)
-                padding = 4 - len(uri) % 4
-                if padding != 4:
-                    uri += "=" * padding
-                decoded = base64.b64decode(uri).decode('utf-8')
-                method_pass, server = decoded.rsplit("@", 1)
-                method, password = method_pass.split(":", 1)
-                host, port = server.rsplit(":", 1)
-            
-            return ProxyNode(
-                protocol="ss",
-                address=host,
-                port=int(port),
-                uuid_or_password=f"{method}:{password}",
-                name=name
-            )
-        except Exception:
+                    method, password = user_info, ""
+            server_info = server_info.partition("?")[0].rstrip("/")
+        else:
+            # 舊格式: base64(method:password@host:port)
+            decoded = b64decode(body)
+            if not decoded:
+                return None
+            text = decoded.decode('utf-8', 'replace')
+            method_pass, at, server_info = text.rpartition("@")
+            method, colon, password = method_pass.partition(":")
+            if not at or not colon:
+                return None
+        
+        host, port = _split_host_port(server_info)
+        if not host or port is None:
             return None
+        
+        return ProxyNode(
+            protocol="ss",
+            address=host,
+            port=port,
+            uuid_or_password=f"{method}:{password}",
+            name=name
+        )
     
     @staticmethod
-    def parse_ssr(uri: str) -> Optional[ProxyNode]:
-        """解析 ssr:// 連結 (ShadowsocksR)"""
-        try:
-            encoded = uri.replace("ssr://", "")
-            padding = 4 - len(encoded) % 4
-            if padding != 4:
-                encoded += "=" * padding
-            decoded = base64.b64decode(encoded).decode('utf-8')
-            
-            # 格式: host:port:protocol:method:obfs:password_base64/?params
-            main_part = decoded.split("/?")[0]
-            parts = main_part.split(":")
-            
-            if len(parts) >= 6:
-                host = parts[0]
-                port = int(parts[1])
-                password_encoded = parts[5]
-                padding = 4 - len(password_encoded) % 4
-                if padding != 4:
-                    password_encoded += "=" * padding
-                password = base64.b64decode(password_encoded).decode('utf-8')
-                
-                return ProxyNode(
-                    protocol="ssr",
-                    address=host,
-                    port=port,
-                    uuid_or_password=password,
-                    name=""
-                )
-        except Exception:
+    def parse_ssr(body: str) -> Optional[ProxyNode]:
+        """解析 ssr:// 之後的內容 (ShadowsocksR)"""
+        decoded = b64decode(body)
+        if not decoded:
             return None
-        return None
+        
+        # 格式: host:port:protocol:method:obfs:password_base64/?params
+        main_part = decoded.decode('utf-8', 'replace').split("/?")[0]
+        parts = main_part.rsplit(":", 5)
+        if len(parts) < 6:
+            return None
+        
+        port = _parse_port(parts[1])
+        password = b64decode(parts[5])
+        if port is None or password is None:
+            return None
+        
+        return ProxyNode(
+            protocol="ssr",
+            address=parts[0],
+            port=port,
+            uuid_or_password=password.decode('utf-8', 'replace'),
+            name=""
+        )
+    
+    # scheme -> 解析函數
+    SCHEMES = {
+        "vmess": parse_vmess,
+        "vless": parse_vless,
+        "trojan": parse_trojan,
+        "ss": parse_ss,
+        "ssr": parse_ssr,
+    }
     
     @classmethod
-    def parse_line(cls, line: str) -> Optional[ProxyNode]:
-        """解析單行節點連結"""
+    def parse_line(cls, line: str, rejected: Optional[Counter] = None) -> Optional[ProxyNode]:
+        """解析單行節點連結；提供 rejected 時按協議統計被拒絕的行數"""
         line = line.strip()
         if not line:
             return None
         
-        if line.startswith("vmess://"):
-            return cls.parse_vmess(line)
-        elif line.startswith("vless://"):
-            return cls.parse_vless(line)
-        elif line.startswith("trojan://"):
-            return cls.parse_trojan(line)
-        elif line.startswith("ss://"):
-            return cls.parse_ss(line)
-        elif line.startswith("ssr://"):
-            return cls.parse_ssr(line)
+        scheme, sep, body = line.partition("://")
+        parser = cls.SCHEMES.get(scheme) if sep else None
+        if parser is None:
+            if rejected is not None:
+                rejected["unknown"] += 1
+            return None
         
-        return None
+        node = parser(body)
+        if node is None and rejected is not None:
+            rejected[scheme] += 1
+        return node
 
 
 class ClashParser:
-    """Clash 配置解析器"""
+    """Clash 配置解析器 - 事件級串流，只組裝頂層 proxies 序列"""
     
     @staticmethod
-    def parse(content: str) -> list[ProxyNode]:
-        """解析 Clash YAML 配置"""
-        nodes = []
+    def _compose(loader, event, anchors: dict):
+        """由已取出的起始事件組裝一個 YAML 節點 (含子節點)"""
+        if isinstance(event, AliasEvent):
+            if event.anchor not in anchors:
+                raise yaml.YAMLError(f"unknown alias {event.anchor!r}")
+            return anchors[event.anchor]
+        
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            if event.anchor:
+                anchors[event.anchor] = node
+            while not loader.check_event(SequenceEndEvent):
+                node.value.append(ClashParser._compose(loader, loader.get_event(), anchors))
+            node.end_mark = loader.get_event().end_mark
+        else:
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            if event.anchor:
+                anchors[event.anchor] = node
+            while not loader.check_event(MappingEndEvent):
+                key = ClashParser._compose(loader, loader.get_event(), anchors)
+                value = ClashParser._compose(loader, loader.get_event(), anchors)
+                node.value.append((key, value))
+            node.end_mark = loader.get_event().end_mark
+        
+        if event.anchor:
+            anchors[event.anchor] = node
+        return node
+    
+    @staticmethod
+    def _skip(loader, event, anchors: dict):
+        """跳過不需要的值；帶錨點的子樹仍會組裝，供 proxies 中的別名引用"""
+        if getattr(event, "anchor", None) and not isinstance(event, AliasEvent):
+            ClashParser._compose(loader, event, anchors)
+            return
+        if isinstance(event, (SequenceStartEvent, MappingStartEvent)):
+            end = SequenceEndEvent if isinstance(event, SequenceStartEvent) else MappingEndEvent
+            while not loader.check_event(end):
+                ClashParser._skip(loader, loader.get_event(), anchors)
+            loader.get_event()
+    
+    @staticmethod
+    def iter_proxies(content) -> Iterator[dict]:
+        """逐個產生頂層 proxies 序列中的項目，不建立其餘文件"""
+        loader = YamlLoader(content)
+        anchors = {}
         try:
-            config = yaml.safe_load(content)
-            proxies = config.get("proxies", [])
+            # StreamStart, DocumentStart
+            loader.get_event()
+            if not loader.check_event(yaml.DocumentStartEvent):
+                return
+            loader.get_event()
+            if not loader.check_event(MappingStartEvent):
+                return
+            loader.get_event()
             
-            for proxy in proxies:
-                ptype = proxy.get("type", "").lower()
-                
-                if ptype == "vmess":
-                    node = ProxyNode(
-                        protocol="vmess",
-                        address=proxy.get("server", ""),
-                        port=int(proxy.get("port", 443)),
-                        uuid_or_password=proxy.get("uuid", ""),
-                        name=proxy.get("name", ""),
-                        network=proxy.get("network", "tcp"),
-                        tls=proxy.get("tls", False),
-                        sni=proxy.get("servername", ""),
-                        path=proxy.get("ws-opts", {}).get("path", ""),
-                        host=proxy.get("ws-opts", {}).get("headers", {}).get("Host", "")
-                    )
-                    nodes.append(node)
-                    
-                elif ptype == "vless":
-                    node = ProxyNode(
-                        protocol="vless",
-                        address=proxy.get("server", ""),
-                        port=int(proxy.get("port", 443)),
-                        uuid_or_password=proxy.get("uuid", ""),
-                        name=proxy.get("name", ""),
-                        network=proxy.get("network", "tcp"),
-                        tls=proxy.get("tls", False),
-                        sni=proxy.get("servername", "")
-                    )
-                    nodes.append(node)
-                    
-                elif ptype == "trojan":
-                    node = ProxyNode(
-                        protocol="trojan",
-                        address=proxy.get("server", ""),
-                        port=int(proxy.get("port", 443)),
-                        uuid_or_password=proxy.get("password", ""),
-                        name=proxy.get("name", ""),
-                        tls=True,
-                        sni=proxy.get("sni", "")
-                    )
-                    nodes.append(node)
-                    
-                elif ptype == "ss":
-                    node = ProxyNode(
-                        protocol="ss",
-                        address=proxy.get("server", ""),
-                        port=int(proxy.get("port", 443)),
-                        uuid_or_password=f"{proxy.get('cipher', '')}:{proxy.get('password', '')}",
-                        name=proxy.get("name", "")
-                    )
+            while not loader.check_event(MappingEndEvent):
+                key = loader.get_event()
+                value = loader.get_event()
+                if not (isinstance(key, ScalarEvent) and key.value == "proxies"):
+                    ClashParser._skip(loader, value, anchors)
+                    continue
+                if not isinstance(value, SequenceStartEvent):
+                    ClashParser._skip(loader, value, anchors)
+                    continue
+                while not loader.check_event(SequenceEndEvent):
+                    node = ClashParser._compose(loader, loader.get_event(), anchors)
+                    proxy = loader.construct_document(node)
+                    if type(proxy) is dict:
+                        yield proxy
+                loader.get_event()
+        finally:
+            loader.dispose()
+    
+    @staticmethod
+    def _opts(proxy: dict, key: str) -> dict:
+        opts = proxy.get(key)
+        return opts if type(opts) is dict else {}
+    
+    @staticmethod
+    def _transport(proxy: dict) -> tuple[str, str, str]:
+        """提取 (network, path, host)，支援 ws-opts 與 grpc-opts"""
+        network = proxy.get("network") or "tcp"
+        path = host = ""
+        if network == "ws":
+            opts = ClashParser._opts(proxy, "ws-opts")
+            path = opts.get("path", "")
+            headers = opts.get("headers")
+            host = headers.get("Host", "") if type(headers) is dict else ""
+        elif network == "grpc":
+            path = ClashParser._opts(proxy, "grpc-opts").get("grpc-service-name", "")
+        return network, path, host
+    
+    @staticmethod
+    def _to_node(proxy: dict) -> Optional[ProxyNode]:
+        """把單個 Clash proxy 轉換為節點"""
+        ptype = str(proxy.get("type", "")).lower()
+        port = _parse_port(proxy.get("port", 443))
+        server = proxy.get("server", "")
+        if port is None or not server:
+            return None
+        server = str(server)
+        name = str(proxy.get("name", ""))
+        
+        if ptype in ("vmess", "vless"):
+            network, path, host = ClashParser._transport(proxy)
+            return ProxyNode(
+                protocol=ptype,
+                address=server,
+                port=port,
+                uuid_or_password=str(proxy.get("uuid", "")),
+                name=name,
+                network=network,
+                tls=bool(proxy.get("tls", False)),
+                sni=proxy.get("servername", "") or "",
+                path=path,
+                host=host
+            )
+        
+        if ptype == "trojan":
+            network, path, host = ClashParser._transport(proxy)
+            return ProxyNode(
+                protocol="trojan",
+                address=server,
+                port=port,
+                uuid_or_password=str(proxy.get("password", "")),
+                name=name,
+                network=network,
+                tls=True,
+                sni=proxy.get("sni", "") or "",
+                path=path,
+                host=host
+            )
+        
+        if ptype == "ss":
+            return ProxyNode(
+                protocol="ss",
+                address=server,
+                port=port,
+                uuid_or_password=f"{proxy.get('cipher', '')}:{proxy.get('password', '')}",
+                name=name
+            )
+        
+        return None
+    
+    @staticmethod
+    def parse(content) -> list[ProxyNode]:
+        """解析 Clash YAML 配置 (str 或 bytes)"""
+        nodes = []
+        try:
+            for proxy in ClashParser.iter_proxies(content):
+                node = ClashParser._to_node(proxy)
+                if node:
                     nodes.append(node)
-                    
         except Exception as e:
             print(f"Clash parse error: {e}")
         
         return nodes
 
 
+def parse_lines_batch(lines: list[str]) -> tuple[list[tuple], dict[str, int]]:
+    """在子進程中解析一批節點行，返回精簡的節點 tuple 與各協議拒絕數"""
+    rejected = Counter()
+    nodes = []
+    for line in lines:
+        node = NodeParser.parse_line(line, rejected)
+        if node:
+            nodes.append(node.to_tuple())
+    return nodes, dict(rejected)
+
+
+def parse_clash_batch(content: bytes) -> list[tuple]:
+    """在子進程中解析 Clash 配置，返回精簡的節點 tuple"""
+    return [node.to_tuple() for node in ClashParser.parse(content)]
+
+
+class PooledLineParser:
+    """分批把節點行送入進程池解析，按提交順序取回結果"""
+    
+    def __init__(self, pool: ProcessPoolExecutor, batch_lines: int, max_pending: int, rejected: Counter):
+        self.pool = pool
+        self.batch_lines = batch_lines
+        self.max_pending = max_pending
+        self.rejected = rejected
+        self._batch: list[str] = []
+        self._pending: deque[asyncio.Future] = deque()
+    
+    async def feed(self, lines: list[str]) -> list[ProxyNode]:
+        """加入新行，返回已完成批次的節點；在途批次過多時等待最舊的一批"""
+        self._batch.extend(lines)
+        while len(self._batch) >= self.batch_lines:
+            self._submit(self._batch[:self.batch_lines])
+            del self._batch[:self.batch_lines]
+        
+        nodes = []
+        while self._pending and (len(self._pending) > self.max_pending or self._pending[0].done()):
+            nodes.extend(await self._collect())
+        return nodes
+    
+    async def close(self, lines: list[str]) -> list[ProxyNode]:
+        """送出剩餘的行並等待全部批次完成"""
+        self._batch.extend(lines)
+        if self._batch:
+            self._submit(self._batch)
+            self._batch = []
+        nodes = []
+        while self._pending:
+            nodes.extend(await self._collect())
+        return nodes
+    
+    def _submit(self, lines: list[str]):
+        loop = asyncio.get_running_loop()
+        self._pending.append(loop.run_in_executor(self.pool, parse_lines_batch, lines))
+    
+    async def _collect(self) -> list[ProxyNode]:
+        nodes, rejected = await self._pending.popleft()
+        self.rejected.update(rejected)
+        return [ProxyNode.restore(values) for values in nodes]
+    
+    def abort(self):
+        """出錯或提前結束時放棄在途批次，並取回已完成批次的例外，避免 "exception was never retrieved" """
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.cancel() and not future.cancelled():
+                future.exception()
+
+
+class NodeIndex:
+    """以正規化身份雜湊為鍵的去重索引，並記錄貢獻每個節點的來源"""
+    
+    def __init__(self):
+        self._nodes: dict[str, ProxyNode] = {}  # unique_id -> node
+        self._sources: dict[str, list[str]] = {}  # unique_id -> 來源名稱
+        self.duplicates = 0
+        self.replaced = 0  # 被之後出現、優先級更高的重複節點取代的次數
+    
+    def add(self, node: ProxyNode) -> bool:
+        """加入節點，返回是否為新節點；重複時保留優先級較高（數字較小）的節點"""
+        uid = node.unique_id
+        current = self._nodes.get(uid)
+        if current is None:
+            self._nodes[uid] = node
+            self._sources[uid] = [node.source]
+            return True
+        
+        self.duplicates += 1
+        if node.priority < current.priority:
+            self._nodes[uid] = node
+            self.replaced += 1
+        sources = self._sources[uid]
+        if node.source not in sources:
+            sources.append(node.source)
+        return False
+    
+    def get(self, uid: str) -> Optional[ProxyNode]:
+        return self._nodes.get(uid)
+    
+    def sources(self, uid: str) -> list[str]:
+        """貢獻該節點的所有來源"""
+        return self._sources.get(uid, [])
+    
+    def nodes(self) -> list[ProxyNode]:
+        return list(self._nodes.values())
+    
+    def __len__(self) -> int:
+        return len(self._nodes)
+    
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._nodes
+
+
+class LineStream:
+    """增量行解碼器 - 逐塊接收位元組，輸出完整的行
+    
+    base64 來源以 4 字元為邊界增量解碼；若開頭看起來不是 base64 則直接按行讀取。
+    """
+    
+    B64_CHARS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/-_="
+    WHITESPACE = b" \t\r\n"
+    URLSAFE = bytes.maketrans(b"-_", b"+/")
+    # 轉換 urlsafe 字元後仍不屬於 base64 字母表的位元組
+    NON_B64 = bytes(set(range(256)) - set(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="))
+    
+    def __init__(self, base64_encoded: bool = False):
+        self.mode: Optional[str] = None if base64_encoded else "plain"
+        self._encoded = b""  # 尚未湊滿 4 字元的 base64 片段
+        self._pending = b""  # 尚未遇到換行的殘行
+    
+    def feed(self, chunk: bytes) -> list[str]:
+        """輸入一塊資料，返回其中已完整的行"""
+        if self.mode is None:
+            sample = chunk[:4096].translate(None, self.WHITESPACE)
+            if not sample:
+                return []
+            # 含有非 base64 字元 (例如 "://") 時視為明文
+            self.mode = "plain" if sample.translate(None, self.B64_CHARS) else "base64"
+        if self.mode == "base64":
+            chunk = self._decode(chunk)
+        return self._split(chunk)
+    
+    def close(self) -> list[str]:
+        """結束輸入，返回剩餘的行"""
+        lines = []
+        if self.mode == "base64" and self._encoded:
+            tail, self._encoded = self._encoded, b""
+            lines = self._split(self._a2b(tail))
+        if self._pending:
+            lines.append(self._pending.decode('utf-8', 'replace'))
+            self._pending = b""
+        return lines
+    
+    def _decode(self, chunk: bytes) -> bytes:
+        # 先去掉雜訊字元，剩下的字元才能保持 4 字元對齊
+        data = self._encoded + chunk.translate(self.URLSAFE).translate(None, self.NON_B64)
+        # "=" 結束一段編碼 (逐行各自編碼再串接的來源)，a2b_base64 會丟棄其後的資料，因此分段解碼
+        *segments, data = data.split(b"=")
+        decoded = [self._a2b(segment) for segment in segments if segment]
+        cut = len(data) - len(data) % 4
+        self._encoded = data[cut:]
+        decoded.append(self._a2b(data[:cut]))
+        return b"".join(decoded)
+    
+    @staticmethod
+    def _a2b(data: bytes) -> bytes:
+        """解碼一段 base64 (自動補齊 padding)；損壞的 4 字元組以換行取代，從下一行重新同步"""
+        if len(data) % 4 == 1:
+            data = data[:-1]
+        data += b"=" * (-len(data) % 4)
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error:
+            pass
+        out = []
+        for i in range(0, len(data), 4):
+            try:
+                out.append(binascii.a2b_base64(data[i:i + 4]))
+            except binascii.Error:
+                out.append(b"\n")
+        return b"".join(out)
+    
+    def _split(self, data: bytes) -> list[str]:
+        lines = (self._pending + data).split(b"\n")
+        self._pending = lines.pop()
+        return [line.decode('utf-8', 'replace') for line in lines]
+
+
+async def _hashed(chunks: AsyncIterator[bytes], hasher) -> AsyncIterator[bytes]:
+    """轉送位元組塊，同時更新雜湊"""
+    async for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+
+class SourceCache:
+    """來源快取 - 保存 HTTP 驗證資訊與已解析的節點，跨次執行重用
+    
+    節點以 ProxyNode.to_tuple() 的精簡形式保存 (含 unique_id)，讀回時不必重新正規化與雜湊；
+    只有條目變更時才寫回文件。
+    """
+    
+    FORMAT = 2  # 節點保存格式；不同時捨棄舊快取
+    
+    def __init__(self, path: str = "cache/sources.json"):
+        self.path = Path(path)
+        self.entries: dict[str, dict] = {}  # url -> entry
+        self.dirty = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("format") == self.FORMAT:
+                self.entries = data.get("entries", {})
+        except (FileNotFoundError, ValueError):
+            pass
+    
+    def conditional_headers(self, url: str) -> dict:
+        """產生條件請求標頭 (If-None-Match / If-Modified-Since)"""
+        entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+    
+    def lookup(self, url: str, digest: Optional[str] = None) -> Optional[list[ProxyNode]]:
+        """取得快取節點；指定 digest 時僅在內容雜湊相同時命中"""
+        entry = self.entries.get(url)
+        if not entry:
+            return None
+        if digest is not None and entry.get("sha256") != digest:
+            return None
+        return [ProxyNode.restore(values) for values in entry.get("nodes", [])]
+    
+    def store(self, url: str, resp: aiohttp.ClientResponse, digest: str, nodes: list[ProxyNode]):
+        """更新快取條目"""
+        self.entries[url] = {
+            "etag": resp.headers.get("ETag", ""),
+            "last_modified": resp.headers.get("Last-Modified", ""),
+            "sha256": digest,
+            "fetched": int(time.time()),
+            "nodes": [node.to_tuple() for node in nodes]
+        }
+        self.dirty = True
+    
+    def matches(self, url: str, digest: str) -> bool:
+        """內容雜湊是否與快取相同"""
+        entry = self.entries.get(url)
+        return bool(entry) and entry.get("sha256") == digest
+    
+    def touch(self, url: str, resp: aiohttp.ClientResponse):
+        """內容未變時僅刷新驗證資訊 (有變化才需要寫回)"""
+        entry = self.entries.get(url)
+        if entry:
+            for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+                value = resp.headers.get(header, entry.get(key, ""))
+                if value != entry.get(key):
+                    entry[key] = value
+                    self.dirty = True
+    
+    def save(self):
+        """有變更時寫回快取文件 (json.dumps 使用 C 編碼器，json.dump 寫文件時不會)"""
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"format": self.FORMAT, "entries": self.entries}, ensure_ascii=False))
+        self.dirty = False
+
+
 class NodeAggregator:
     """節點聚合器"""
     
-    def __init__(self, config_path: str = "config/sources.json"):
+    def __init__(self, config_path: str = "config/sources.json", settings_path: str = "config/settings.json"):
         with open(config_path, 'r') as f:
             self.config = json.load(f)
-        self.nodes: dict[str, ProxyNode] = {}  # unique_id -> node
+        with open(settings_path, 'r') as f:
+            self.settings = json.load(f)
+        self.index = NodeIndex()
+        
+        self.aggregate_config = self.settings.get("aggregation", {})
+        cache_config = self.aggregate_config.get("cache", {})
+        self.cache: Optional[SourceCache] = None
+        if cache_config.get("enabled", True):
+            self.cache = SourceCache(cache_config.get("path", "cache/sources.json"))
+        
+        # 大型來源改用進程池解析，避免阻塞事件循環
+        parse_config = self.aggregate_config.get("parsing", {})
+        self.pool_enabled = parse_config.get("process_pool", True)
+        self.pool_threshold = parse_config.get("pool_threshold_bytes", 1024 * 1024)
+        self.batch_lines = parse_config.get("batch_lines", 2000)
+        self.pool_workers = parse_config.get("workers") or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
     
-    async def fetch_source(self, session: aiohttp.ClientSession, source: dict) -> list[ProxyNode]:
-        """獲取單個來源的節點"""
+    CHUNK_SIZE = 64 * 1024
+    
+    def _use_pool(self, size: int) -> bool:
+        """依內容大小決定是否使用進程池"""
+        return self.pool_enabled and size >= self.pool_threshold
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn 避免在已有執行緒的事件循環中 fork
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.pool_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+    
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+    
+    def _new_line_parser(self, rejected: Counter) -> PooledLineParser:
+        return PooledLineParser(self._get_pool(), self.batch_lines, self.pool_workers * 2, rejected)
+    
+    @staticmethod
+    def _parse_inline(lines: list[str], rejected: Counter) -> list[ProxyNode]:
         nodes = []
+        for line in lines:
+            node = NodeParser.parse_line(line, rejected)
+            if node:
+                nodes.append(node)
+        return nodes
+    
+    async def _stream_nodes(self, chunks: AsyncIterator[bytes], source_type: str,
+                            size: Optional[int], rejected: Counter) -> AsyncIterator[ProxyNode]:
+        """把位元組塊切成行並解析；已知或已接收的大小超過門檻時改為進程池批次解析"""
+        stream = LineStream(base64_encoded=source_type == "base64")
+        # 已知大小 (Content-Length) 在讀取前判斷；未知時依實際接收的位元組數判斷
+        parser = self._new_line_parser(rejected) if size and self._use_pool(size) else None
+        received = 0
         try:
-            async with session.get(source["url"], timeout=aiohttp.ClientTimeout(total=30)) as resp:
-                if resp.status != 200:
+            async for chunk in chunks:
+                received += len(chunk)
+                if parser is None and self._use_pool(received):
+                    parser = self._new_line_parser(rejected)
+                lines = stream.feed(chunk)
+                for node in (await parser.feed(lines) if parser else self._parse_inline(lines, rejected)):
+                    yield node
+            lines = stream.close()
+            for node in (await parser.close(lines) if parser else self._parse_inline(lines, rejected)):
+                yield node
+        finally:
+            if parser:
+                parser.abort()
+    
+    async def iter_source(self, session: aiohttp.ClientSession, source: dict) -> AsyncIterator[ProxyNode]:
+        """逐步獲取單個來源的節點，邊下載邊解析"""
+        url = source["url"]
+        source_type = source.get("type", "mixed")
+        headers = self.cache.conditional_headers(url) if self.cache else {}
+        nodes = []
+        hit = ""
+        streamed = False
+        rejected = Counter()  # 協議 -> 被拒絕的行數
+        try:
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                if resp.status == 304 and self.cache and url in self.cache.entries:
+                    # 上游未變更，直接使用上次解析結果
+                    nodes, hit = self.cache.lookup(url), "304"
+                elif resp.status != 200:
                     print(f"Failed to fetch {source['name']}: HTTP {resp.status}")
-                    return nodes
-                
-                content = await resp.text()
-                source_type = source.get("type", "mixed")
+                    return
+                elif source_type == "clash":
+                    # YAML 需要完整文件，讀完後先比對雜湊再決定是否解析
+                    hasher = hashlib.sha256()
+                    chunks = []
+                    async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                        hasher.update(chunk)
+                        chunks.append(chunk)
+                    digest = hasher.hexdigest()
+                    if self.cache and self.cache.matches(url, digest):
+                        nodes, hit = self.cache.lookup(url), "hash"
+                    else:
+                        body = b"".join(chunks)
+                        if self._use_pool(len(body)):
+                            loop = asyncio.get_running_loop()
+                            fields = await loop.run_in_executor(self._get_pool(), parse_clash_batch, body)
+                            nodes = [ProxyNode.restore(values) for values in fields]
+                        else:
+                            nodes = ClashParser.parse(body)
+                        del body
+                    del chunks
+                else:
+                    # 逐塊讀取位元組，完整的行立即交給解析器，同時計算雜湊；
+                    # 相同內容必定解析出相同節點，讀完後雜湊未變就只刷新快取的驗證資訊
+                    hasher = hashlib.sha256()
+                    chunks = _hashed(resp.content.iter_chunked(self.CHUNK_SIZE), hasher)
+                    async for node in self._stream_nodes(chunks, source_type, resp.content_length, rejected):
+                        nodes.append(node)
+                        yield self._tag(node, source)
+                    digest = hasher.hexdigest()
+                    streamed = True
+                    if self.cache and self.cache.matches(url, digest):
+                        hit = "hash"
                 
-                if source_type == "clash":
-                    nodes = ClashParser.parse(content)
-                elif source_type == "base64":
-                    # 整個內容是 base64 編碼的多行節點
-                    try:
-                        padding = 4 - len(content.strip()) % 4
-                        if padding != 4:
-                            content = content.strip() + "=" * padding
-                        decoded = base64.b64decode(content).decode('utf-8')
-                        for line in decoded.split('\n'):
-                            node = NodeParser.parse_line(line)
-                            if node:
-                                nodes.append(node)
-                    except:
-                        # 可能不是 base64，嘗試直接解析
-                        for line in content.split('\n'):
-                            node = NodeParser.parse_line(line)
-                            if node:
-                                nodes.append(node)
-                else:  # mixed
-                    for line in content.split('\n'):
-                        node = NodeParser.parse_line(line)
-                        if node:
-                            nodes.append(node)
+                if not streamed:
+                    for node in nodes:
+                        yield self._tag(node, source)
                 
-                # 設定來源資訊
-                for node in nodes:
-                    node.source = source["name"]
-                    node.priority = source.get("priority", 99)
+                if self.cache:
+                    if hit:
+                        self.cache.touch(url, resp)
+                    else:
+                        self.cache.store(url, resp, digest, nodes)
                 
-                print(f"✓ {source['name']}: {len(nodes)} nodes")
+                suffix = f" (快取命中: {hit})" if hit else ""
+                if rejected:
+                    counts = ", ".join(f"{k}={v}" for k, v in rejected.most_common())
+                    suffix += f" [拒絕: {counts}]"
+                print(f"✓ {source['name']}: {len(nodes)} nodes{suffix}")
                 
         except Exception as e:
             print(f"✗ {source['name']}: {e}")
-        
-        return nodes
     
-    async def aggregate(self) -> list[ProxyNode]:
-        """聚合所有來源"""
-        print("🦐 開始聚合節點...\n")
-        
+    @staticmethod
+    def _tag(node: ProxyNode, source: dict) -> ProxyNode:
+        """設定來源資訊；這裡的節點都是本次解析或從快取還原的新物件，就地設定而不複製"""
+        node._set_source(source["name"], source.get("priority", 99))
+        return node
+    
+    async def fetch_source(self, session: aiohttp.ClientSession, source: dict) -> list[ProxyNode]:
+        """獲取單個來源的節點"""
+        return [node async for node in self.iter_source(session, source)]
+    
+    async def _run_sources(self, queue: Optional[asyncio.Queue] = None):
+        """並行抓取所有來源並即時去重；提供佇列時把新的唯一節點放入佇列"""
         async with aiohttp.ClientSession() as session:
+            async def pump(source: dict):
+                async for node in self.iter_source(session, source):
+                    if node.address and node.port and self.index.add(node) and queue is not None:
+                        # 有界佇列：測試端跟不上時在此等待 (背壓)
+                        await queue.put(node)
+            
             tasks = []
             for source in self.config["sources"]:
                 if source.get("enabled", True):
-                    tasks.append(self.fetch_source(session, source))
-            
-            results = await asyncio.gather(*tasks)
+                    tasks.append(pump(source))
             
-            # 合併並去重
-            for source_nodes in results:
-                for node in source_nodes:
-                    if node.address and node.port:
-                        uid = node.unique_id
-                        # 保留優先級較高（數字較小）的節點
-                        if uid not in self.nodes or node.priority < self.nodes[uid].priority:
-                            self.nodes[uid] = node
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                self._shutdown_pool()
         
+        if self.cache:
+            self.cache.save()
+    
+    def _sorted_nodes(self) -> list[ProxyNode]:
         # 轉換為列表並排序
-        all_nodes = list(self.nodes.values())
+        all_nodes = self.index.nodes()
         all_nodes.sort(key=lambda x: (x.priority, x.address))
         
-        print(f"\n總計: {len(all_nodes)} 個唯一節點")
+        print(f"\n總計: {len(all_nodes)} 個唯一節點 (合併 {self.index.duplicates} 個重複)")
         return all_nodes
     
-    def save_nodes(self, nodes: list[ProxyNode], output_path: str = "output/raw_nodes.json"):
-        """保存節點到文件"""
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-        
-        data = {
-            "count": len(nodes),
-            "updated": __import__('datetime').datetime.utcnow().isoformat() + "Z",
-            "nodes": [asdict(node) for node in nodes]
-        }
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    async def aggregate(self) -> list[ProxyNode]:
+        """聚合所有來源"""
+        print("🦐 開始聚合節點...\n")
+        await self._run_sources()
+        return self._sorted_nodes()
+    
+    async def stream(self, queue: asyncio.Queue) -> list[ProxyNode]:
+        """聚合所有來源，唯一節點一經解析即送入佇列；結束時放入 None"""
+        print("🦐 開始聚合節點 (流水線模式)...\n")
+        try:
+            await self._run_sources(queue)
+        finally:
+            await queue.put(None)
+        return self._sorted_nodes()
+    
+    def save_nodes(self, nodes: list[ProxyNode], output_path: str = RAW_NODES_PATH):
+        """保存節點到文件 (NDJSON)"""
+        with NDJSONWriter(output_path, "raw", flush_every=1000) as writer:
+            for node in nodes:
+                writer.write(dict(node.to_dict(), sources=self.index.sources(node.unique_id)))
         
         print(f"✓ 已保存到 {output_path}")
 
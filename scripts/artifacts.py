@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+中間產物讀寫 - 各階段之間以 NDJSON 傳遞節點
+
+格式: 第一行為 header 記錄，之後每行一個節點，結束時寫入 summary 記錄。
+header / summary 以 "record" 欄位區分，節點記錄沒有此欄位。
+"""
+
+import os
+import json
+from pathlib import Path
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+FORMAT = "proxy-aggregator/nodes"
+VERSION = 1
+
+RAW_NODES_PATH = "output/raw_nodes.ndjson"
+TESTED_NODES_PATH = "output/tested_nodes.ndjson"
+
+
+class NDJSONWriter:
+    """逐筆寫入節點記錄，每筆之後 flush，中途崩潰也保留已寫入的內容"""
+
+    def __init__(self, path: str, kind: str, flush_every: int = 1):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.count = 0
+        self.flush_every = max(1, flush_every)
+        self._file = open(path, 'w', encoding='utf-8')
+        self._write({
+            "record": "header",
+            "format": FORMAT,
+            "version": VERSION,
+            "kind": kind,
+            "updated": datetime.utcnow().isoformat() + "Z"
+        })
+        self._file.flush()
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+
+    def write(self, record: dict):
+        """寫入一個節點記錄"""
+        self._write(record)
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+
+    def close(self, **summary):
+        """寫入 summary 記錄並關閉文件"""
+        if self._file.closed:
+            return
+        self._write({"record": "summary", "count": self.count, **summary})
+        self._file.close()
+
+    def __enter__(self) -> "NDJSONWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    """惰性讀取節點記錄；損壞的行 (例如崩潰時寫了一半) 會被略過"""
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            header = None
+
+        if not isinstance(header, dict) or header.get("record") != "header":
+            # 舊版 json.dump(indent=2) 格式
+            f.seek(0)
+            yield from json.load(f).get("nodes", [])
+            return
+
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "record" not in record:
+                yield record
+
+
+def read_summary(path: str) -> Optional[dict]:
+    """讀取結尾的 summary 記錄；文件不存在或未正常結束時返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 65536))
+            last = f.read().rstrip(b"\n").rpartition(b"\n")[2]
+    except OSError:
+        return None
+    try:
+        record = json.loads(last)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) and record.get("record") == "summary" else None
+
+
+def rewrite_records(path: str, transform: Callable[[dict], dict]) -> int:
+    """逐行改寫節點記錄 (header / summary 原樣保留)，寫入臨時文件後替換；返回改動的記錄數"""
+    changed = 0
+    tmp = path + ".tmp"
+    with open(path, 'r', encoding='utf-8') as src, open(tmp, 'w', encoding='utf-8') as dst:
+        for line in src:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "record" not in record:
+                updated = transform(record)
+                if updated != record:
+                    changed += 1
+                    line = json.dumps(updated, ensure_ascii=False, separators=(",", ":")) + "\n"
+            dst.write(line)
+    os.replace(tmp, path)
+    return changed
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+離線 ASN / 國家資料庫 - 匯入 iptoasn.com 的 ip2asn-combined.tsv
+
+匯入後以排序好的整數陣列保存 (IPv4 為 uint32，IPv6 拆成兩個 uint64)，
+查詢時以 mmap 開啟並二分搜尋，不需要網路，單次查詢為微秒級。
+數據中心判斷依 AS 描述中的關鍵字推測。
+
+用法:
+    python scripts/asn_db.py import ip2asn-combined.tsv.gz
+    python scripts/asn_db.py update            # 資料庫過期時下載並匯入
+    python scripts/asn_db.py lookup 1.1.1.1
+"""
+
+import io
+import re
+import sys
+import gzip
+import json
+import mmap
+import time
+import socket
+import array
+import bisect
+import ipaddress
+import urllib.request
+from pathlib import Path
+from typing import Iterator, Optional
+
+DEFAULT_PATH = "cache/asn_db"
+DEFAULT_URL = "https://iptoasn.com/data/ip2asn-combined.tsv.gz"
+
+# AS 描述中出現這些詞 (以單詞邊界比對) 時視為數據中心 / 雲端 / 主機商
+# 只收錄不會出現在一般 ISP 名稱中的詞，例如 "server" 或 "it7" 會誤判一般電信
+DATACENTER_KEYWORDS = (
+    "hosting", "cloud", "datacenter", "data center", "data-center", "vps", "colocation",
+    "dedicated servers", "amazon", "aws", "google cloud", "microsoft", "azure",
+    "digitalocean", "linode", "akamai", "ovh", "hetzner", "vultr", "choopa", "contabo",
+    "leaseweb", "m247", "alibaba", "aliyun", "tencent", "oracle", "scaleway", "cloudflare",
+    "fastly", "gcore", "g-core", "kamatera", "hostinger", "ionos", "upcloud", "bandwagon",
+    "racknerd", "colocrossing", "psychz", "quadranet", "zenlayer", "datacamp",
+)
+_DATACENTER_RE = re.compile(r"\b(?:" + "|".join(re.escape(k) for k in DATACENTER_KEYWORDS) + r")\b")
+
+# 描述是 AS 代號、關鍵字比對不到的常見雲端 / CDN ASN (例如 Cloudflare 的 "CLOUDFLARENET"、Google 的 "GOOGLE")
+DATACENTER_ASNS = frozenset((
+    13335, 209242,          # Cloudflare
+    16509, 14618,           # Amazon
+    15169, 396982,          # Google
+    8075,                   # Microsoft
+    20940, 16625, 63949,    # Akamai / Linode
+    14061,                  # DigitalOcean
+    16276,                  # OVH
+    24940,                  # Hetzner
+    20473,                  # Vultr (Choopa)
+    51167,                  # Contabo
+    60781,                  # Leaseweb
+    9009,                   # M247
+    45102, 37963,           # Alibaba
+    132203, 45090,          # Tencent
+    31898,                  # Oracle
+    12876,                  # Scaleway
+    54113,                  # Fastly
+    199524,                 # G-Core
+    36352,                  # ColoCrossing
+    25820,                  # IT7 (BandwagonHost)
+    8100,                   # QuadraNet
+    21859,                  # Zenlayer
+    60068, 212238,          # Datacamp / CDN77
+))
+
+
+def is_datacenter(description: str, asn: int = 0) -> bool:
+    """依 ASN 與 AS 描述推測是否為數據中心"""
+    return asn in DATACENTER_ASNS or _DATACENTER_RE.search(description.lower()) is not None
+
+
+def _pack_country(code: str) -> int:
+    code = (code or "").upper()
+    if len(code) != 2:  # iptoasn 以 "None" 表示未知
+        return 0
+    return (ord(code[0]) << 8) | ord(code[1])
+
+
+def _unpack_country(value: int) -> str:
+    return chr(value >> 8) + chr(value & 0xFF) if value else ""
+
+
+def _open_dump(path: str) -> io.TextIOBase:
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def _iter_ranges(path: str) -> Iterator[tuple[int, int, int, int, str, str]]:
+    """逐行讀取 dump，返回 (版本, 起點, 終點, ASN, 國家, 描述)；略過未路由的範圍"""
+    with _open_dump(path) as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 5:
+                continue
+            try:
+                start = ipaddress.ip_address(parts[0])
+                end = ipaddress.ip_address(parts[1])
+                asn = int(parts[2])
+            except ValueError:
+                continue
+            if asn == 0:
+                continue
+            yield start.version, int(start), int(end), asn, parts[3], parts[4]
+
+
+def import_dump(dump_path: str, out_dir: str = DEFAULT_PATH) -> dict:
+    """把 dump 轉成二進位陣列文件與 meta.json，返回 meta"""
+    v4 = [array.array("I") for _ in range(3)] + [array.array("H")]
+    v6 = [array.array("Q") for _ in range(2)] + [array.array("I"), array.array("H")]
+    asns: dict[str, list] = {}
+    mask = (1 << 64) - 1
+
+    # iptoasn 的 dump 已依起點排序且範圍不重疊
+    for version, start, end, asn, country, description in _iter_ranges(dump_path):
+        if version == 4:
+            v4[0].append(start)
+            v4[1].append(end)
+            v4[2].append(asn)
+            v4[3].append(_pack_country(country))
+        else:
+            v6[0].extend((start >> 64, start & mask))
+            v6[1].extend((end >> 64, end & mask))
+            v6[2].append(asn)
+            v6[3].append(_pack_country(country))
+        if str(asn) not in asns:
+            asns[str(asn)] = [description, is_datacenter(description, asn)]
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    for name, arrays in (("v4.bin", v4), ("v6.bin", v6)):
+        tmp = out / (name + ".tmp")
+        with open(tmp, 'wb') as f:
+            for arr in arrays:
+                arr.tofile(f)
+        tmp.replace(out / name)
+
+    meta = {
+        "source": str(dump_path),
+        "imported": time.time(),
+        "v4": len(v4[2]),
+        "v6": len(v6[2]),
+        "byteorder": sys.byteorder,
+        "asns": asns
+    }
+    with open(out / "meta.json", 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+class _Uint128View:
+    """把 (高 64 位, 低 64 位) 交錯的 uint64 陣列當作 128 位整數序列，供 bisect 使用"""
+
+    def __init__(self, words: memoryview):
+        self.words = words
+
+    def __len__(self) -> int:
+        return len(self.words) // 2
+
+    def __getitem__(self, index: int) -> int:
+        return (self.words[2 * index] << 64) | self.words[2 * index + 1]
+
+
+class ASNDatabase:
+    """以 mmap 開啟匯入後的資料庫，二分搜尋 IP 所在範圍"""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = Path(path)
+        with open(self.path / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("byteorder", sys.byteorder) != sys.byteorder:
+            raise ValueError("ASN database was imported on a machine with different byte order")
+        self.imported = meta.get("imported", 0)
+        self.asns = meta.get("asns", {})
+        self._files = []
+        self.v4 = self._map("v4.bin", meta["v4"], ("I", "I", "I", "H"), (4, 4, 4, 2))
+        self.v6 = self._map("v6.bin", meta["v6"], ("Q", "Q", "I", "H"), (16, 16, 4, 2))
+        if self.v6:
+            self.v6[0] = _Uint128View(self.v6[0])
+            self.v6[1] = _Uint128View(self.v6[1])
+
+    def _map(self, name: str, count: int, formats: tuple, sizes: tuple) -> list:
+        if not count:
+            return []
+        f = open(self.path / name, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._files.append((f, mm))
+        view = memoryview(mm)
+        columns, offset = [], 0
+        for fmt, size in zip(formats, sizes):
+            columns.append(view[offset:offset + size * count].cast(fmt))
+            offset += size * count
+        return columns
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        """返回 IP 所屬的 ASN、國家、描述與數據中心推測；查不到時為 None"""
+        try:
+            if ":" in ip:
+                columns = self.v6
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+            else:
+                columns = self.v4
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        except OSError:
+            return None
+        if not columns:
+            return None
+        starts, ends, asns, countries = columns
+        index = bisect.bisect_right(starts, value) - 1
+        if index < 0 or value > ends[index]:
+            return None
+
+        asn = asns[index]
+        description, datacenter = self.asns.get(str(asn), ["", False])
+        return {
+            "country": _unpack_country(countries[index]),
+            "asn": asn,
+            "org": description,
+            # 匯入較早的資料庫沒有依 DATACENTER_ASNS 標記
+            "is_datacenter": datacenter or asn in DATACENTER_ASNS,
+            "is_vpn": False
+        }
+
+    def age_hours(self) -> float:
+        return (time.time() - self.imported) / 3600
+
+    def close(self):
+        self.v4 = self.v6 = []
+        for f, mm in self._files:
+            try:
+                mm.close()
+            except BufferError:
+                # 仍有 memoryview 引用時交給垃圾回收
+                pass
+            f.close()
+        self._files = []
+
+
+def update(out_dir: str = DEFAULT_PATH, url: str = DEFAULT_URL, max_age_hours: float = 168) -> bool:
+    """資料庫不存在或超過 max_age_hours 時下載並匯入，返回是否更新"""
+    meta_path = Path(out_dir) / "meta.json"
+    if meta_path.exists():
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            imported = json.load(f).get("imported", 0)
+        if (time.time() - imported) / 3600 < max_age_hours:
+            print(f"✓ ASN 資料庫仍在有效期內 ({out_dir})")
+            return False
+
+    dump = Path(out_dir) / "ip2asn-combined.tsv.gz"
+    dump.parent.mkdir(parents=True, exist_ok=True)
+    print(f"⬇ 下載 {url}")
+    urllib.request.urlretrieve(url, dump)
+    meta = import_dump(str(dump), out_dir)
+    dump.unlink()
+    print(f"✓ ASN 資料庫: IPv4 {meta['v4']} / IPv6 {meta['v6']} 個範圍, {len(meta['asns'])} 個 ASN")
+    return True
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) >= 2 and argv[0] == "import":
+        out_dir = argv[2] if len(argv) > 2 else DEFAULT_PATH
+        meta = import_dump(argv[1], out_dir)
+        print(f"✓ ASN 資料庫: IPv4 {meta['v4']} / IPv6 {meta['v6']} 個範圍, {len(meta['asns'])} 個 ASN")
+        return 0
+    if argv and argv[0] == "update":
+        try:
+            update(*argv[1:2])
+        except Exception as e:
+            print(f"✗ ASN 資料庫更新失敗: {e}")
+            return 1
+        return 0
+    if len(argv) >= 2 and argv[0] == "lookup":
+        db = ASNDatabase()
+        for ip in argv[1:]:
+            print(ip, db.lookup(ip))
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
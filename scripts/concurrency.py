@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+自適應並發控制 - AIMD (加性增、乘性減)
+
+每完成一個窗口的測試就比較延遲中位數與錯誤率：
+維持穩定時並發上限加 step，延遲或錯誤率惡化時乘以 backoff。
+上限不超過 RLIMIT_NOFILE 允許的文件描述符數量。
+"""
+
+import asyncio
+import statistics
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 保留給日誌、快取文件、aiohttp 連線池等的描述符
+FD_RESERVE = 64
+EWMA_ALPHA = 0.2
+# 延遲增加少於此值時不視為惡化 (避免低延遲時的毫秒級抖動觸發退讓)
+LATENCY_SLACK_MS = 20
+
+
+def fd_limit(raise_soft: bool = True) -> Optional[int]:
+    """返回可用的文件描述符上限；可能時先把軟限制提高到硬限制"""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if raise_soft and hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return soft
+
+
+class AdaptiveLimiter:
+    """AIMD 並發限制器，用法: async with limiter: ...; limiter.record(latency_ms, ok)"""
+
+    def __init__(self, initial: int = 50, minimum: int = 10, maximum: int = 500,
+                 window: int = 50, step: int = 5, backoff: float = 0.75,
+                 latency_tolerance: float = 1.5, error_margin: float = 0.15,
+                 adaptive: bool = True):
+        limit = fd_limit()
+        if limit is not None:
+            maximum = min(maximum, max(1, limit - FD_RESERVE))
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = max(self.minimum, min(initial, self.maximum))
+        self.adaptive = adaptive
+        self.window = max(1, window)
+        self.step = step
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.error_margin = error_margin
+
+        self.in_flight = 0
+        self.peak = self.limit
+        self.adjustments = 0
+        self._condition = asyncio.Condition()
+        self._latencies: list[float] = []
+        self._errors = 0
+        self._samples = 0
+        # 基準值為各窗口的指數移動平均 (公開列表中本來就有大量死節點，錯誤率不會是 0)
+        self._base_latency: Optional[float] = None
+        self._base_error: Optional[float] = None
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.in_flight -= 1
+            # 只喚醒空出名額數量的等待者，避免每次釋放都喚醒全部
+            self._condition.notify(max(0, self.limit - self.in_flight))
+
+    def record(self, latency_ms: Optional[float], ok: bool):
+        """回報一次測試結果 (在 async with 區塊內呼叫)；失敗時 latency_ms 可為 None"""
+        if not self.adaptive:
+            return
+        self._samples += 1
+        if ok and latency_ms is not None:
+            self._latencies.append(latency_ms)
+        else:
+            self._errors += 1
+        if self._samples >= self.window:
+            self._adjust()
+
+    def _adjust(self):
+        error_rate = self._errors / self._samples
+        latency = statistics.median(self._latencies) if self._latencies else None
+        self._latencies = []
+        self._errors = 0
+        self._samples = 0
+
+        degraded = False
+        if self._base_error is not None:
+            degraded = error_rate > self._base_error + self.error_margin
+        if latency is not None and self._base_latency:
+            degraded = degraded or (latency > self._base_latency * self.latency_tolerance
+                                    and latency - self._base_latency > LATENCY_SLACK_MS)
+
+        self._base_error = error_rate if self._base_error is None else \
+            self._base_error + EWMA_ALPHA * (error_rate - self._base_error)
+        if latency is not None:
+            self._base_latency = latency if self._base_latency is None else \
+                self._base_latency + EWMA_ALPHA * (latency - self._base_latency)
+
+        if degraded:
+            new_limit = max(self.minimum, int(self.limit * self.backoff))
+        else:
+            new_limit = min(self.maximum, self.limit + self.step)
+
+        if new_limit != self.limit:
+            self.adjustments += 1
+            self.limit = new_limit
+            self.peak = max(self.peak, new_limit)
+            # 等待者在下一次 __aexit__ 時依新上限重新判斷
+
+    def stats(self) -> dict:
+        """供 summary 記錄的統計資訊"""
+        return {
+            "adaptive": self.adaptive,
+            "final": self.limit,
+            "peak": self.peak,
+            "min": self.minimum,
+            "max": self.maximum,
+            "adjustments": self.adjustments
+        }
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+DNS 解析階段 - 主機名去重、並行解析、跨次執行的 TTL 快取
+"""
+
+import json
+import time
+import socket
+import asyncio
+import ipaddress
+from pathlib import Path
+from typing import Iterable, Optional
+
+from dns_resolver import AsyncResolver
+from singleflight import SingleFlight
+
+
+# getaddrinfo 中代表「名稱確實不存在」的錯誤；其他 (EAI_AGAIN、逾時等) 為暫時性失敗
+NEGATIVE_GAI_ERRORS = {socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)}
+
+
+def is_ip(host: str) -> bool:
+    """是否已經是 IP 位址"""
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def sort_addresses(addrs: Iterable[str]) -> list[str]:
+    """去重並把 IPv4 排在前面 (GitHub Actions 執行器通常沒有 IPv6 連線)"""
+    unique = list(dict.fromkeys(addrs))
+    return sorted(unique, key=lambda ip: ":" in ip)
+
+
+class DNSCache:
+    """主機名解析快取 - 保存所有 A/AAAA 記錄，依 TTL 過期，名稱不存在的結果短暫快取"""
+
+    def __init__(self, path: str = "cache/dns.json", negative_ttl: int = 300):
+        self.path = Path(path)
+        self.negative_ttl = negative_ttl
+        self.entries: dict[str, dict] = {}  # host -> {"addrs": [...], "expires": ts}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get("entries", {})
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def get(self, host: str) -> Optional[list[str]]:
+        """返回未過期的記錄；未命中為 None，快取的解析失敗為空列表"""
+        entry = self.entries.get(host)
+        if not entry:
+            return None
+        if entry["expires"] < time.time():
+            del self.entries[host]
+            return None
+        return entry["addrs"]
+
+    def put(self, host: str, addrs: list[str], ttl: int):
+        """寫入記錄；否定回應最多快取 negative_ttl 秒"""
+        if not addrs:
+            ttl = min(ttl, self.negative_ttl) if ttl > 0 else self.negative_ttl
+        self.entries[host] = {"addrs": addrs, "expires": int(time.time() + ttl)}
+
+    def save(self):
+        """寫回文件，順便清除過期條目"""
+        now = time.time()
+        entries = {h: e for h, e in self.entries.items() if e["expires"] >= now}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": entries}, f)
+
+
+class HostResolver:
+    """主機名解析器 - 先查快取，再以有限並發解析
+
+    提供 engine (AsyncResolver) 時使用原生非阻塞查詢與記錄本身的 TTL，
+    否則退回執行緒池中的 getaddrinfo。
+    """
+
+    def __init__(self, cache: Optional[DNSCache] = None, concurrency: int = 100,
+                 timeout: float = 10, default_ttl: int = 3600,
+                 engine: Optional[AsyncResolver] = None):
+        self.cache = cache
+        self.timeout = timeout
+        # getaddrinfo 不提供 TTL，使用設定的預設值
+        self.default_ttl = default_ttl
+        self.engine = engine
+        self.flight = SingleFlight()  # 同一主機名的並發解析只查詢一次
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _lookup(self, host: str) -> tuple[list[str], Optional[int]]:
+        """實際查詢，返回 (位址列表, TTL)
+
+        只有 NXDOMAIN / NODATA 這類確定的否定回應才有 TTL；
+        逾時與傳輸錯誤的 TTL 為 None，不寫入快取，下次再查。
+        """
+        if self.engine:
+            async with self._semaphore:
+                try:
+                    addrs, ttl = await self.engine.resolve(host)
+                except Exception:
+                    return [], None
+            return sort_addresses(addrs), ttl
+
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            try:
+                result = await asyncio.wait_for(
+                    loop.getaddrinfo(host, None, type=socket.SOCK_STREAM),
+                    timeout=self.timeout
+                )
+            except socket.gaierror as e:
+                return [], (0 if e.errno in NEGATIVE_GAI_ERRORS else None)
+            except Exception:
+                return [], None
+        return sort_addresses(info[4][0] for info in result), self.default_ttl
+
+    async def resolve(self, host: str) -> list[str]:
+        """解析主機名的所有位址 (IPv4 優先)"""
+        addrs, _ = await self.resolve_timed(host)
+        return addrs
+    
+    async def resolve_timed(self, host: str) -> tuple[list[str], int]:
+        """解析並返回 (位址, 查詢耗時 ms)；只有實際發出查詢的呼叫有耗時，快取命中或共用進行中的查詢為 0"""
+        if is_ip(host):
+            return [host], 0
+
+        if self.cache:
+            cached = self.cache.get(host)
+            if cached is not None:
+                return cached, 0
+
+        (addrs, elapsed_ms), leader = await self.flight.execute(host, lambda: self._resolve_uncached(host))
+        return addrs, elapsed_ms if leader else 0
+    
+    async def _resolve_uncached(self, host: str) -> tuple[list[str], int]:
+        start = time.perf_counter()
+        addrs, ttl = await self._lookup(host)
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        if self.cache and ttl is not None:
+            self.cache.put(host, addrs, ttl)
+        return addrs, elapsed_ms
+
+    async def resolve_many(self, hosts: Iterable[str]) -> dict[str, list[str]]:
+        """去重後並行解析一批主機名"""
+        unique = list(dict.fromkeys(h for h in hosts if h))
+        results = await asyncio.gather(*(self.resolve(h) for h in unique))
+        return dict(zip(unique, results))
+
+    def save(self):
+        if self.cache:
+            self.cache.save()
+
+    async def close(self):
+        """保存快取並關閉解析引擎的連線"""
+        self.save()
+        if self.engine:
+            await self.engine.close()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+原生 asyncio DNS 客戶端 - 不經過執行緒池，單一 socket 上管線化大量查詢
+
+支援 UDP (截斷時改用 TCP)、TCP、DoT (DNS over TLS) 與 DoH (DNS over HTTPS)，
+上游可設定為 "ip" 或 "ip:port"，方便以本地替身伺服器測試。
+"""
+
+import ssl
+import random
+import contextlib
+import socket
+import struct
+import asyncio
+import aiohttp
+from dataclasses import dataclass, field
+from typing import Optional
+
+QTYPE_A = 1
+QTYPE_AAAA = 28
+QTYPE_CNAME = 5
+QTYPE_SOA = 6
+QTYPE_OPT = 41
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+EDNS_PAYLOAD = 1232
+DEFAULT_NEGATIVE_TTL = 300
+HOSTS_TTL = 3600
+
+# 每個上游使用數個 UDP socket，每個 socket 同時進行的查詢有上限，
+# 避免大量回應同時抵達時超出接收緩衝區而被核心丟棄
+UDP_SOCKETS = 4
+UDP_MAX_INFLIGHT = 64
+UDP_RCVBUF = 1 << 20
+
+
+class DNSError(Exception):
+    """DNS 查詢或解析失敗"""
+
+
+@dataclass
+class DNSResponse:
+    """DNS 回應 (只保留需要的部分)"""
+    qid: int
+    rcode: int
+    truncated: bool
+    qname: str = ""
+    qtype: int = 0
+    addresses: list[str] = field(default_factory=list)
+    ttl: int = 0  # 位址記錄的最小 TTL；否定回應時為 SOA 推得的否定 TTL
+
+
+def build_query(qid: int, name: str, qtype: int) -> bytes:
+    """組裝帶 EDNS0 的遞迴查詢封包"""
+    qname = b""
+    for label in name.rstrip(".").split("."):
+        try:
+            encoded = label.encode("ascii")
+        except UnicodeEncodeError:
+            encoded = label.encode("idna")
+        if not encoded or len(encoded) > 63:
+            raise DNSError(f"invalid name {name!r}")
+        qname += bytes((len(encoded),)) + encoded
+    header = struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 1)
+    question = qname + b"\x00" + struct.pack("!HH", qtype, 1)
+    opt = b"\x00" + struct.pack("!HHIH", QTYPE_OPT, EDNS_PAYLOAD, 0, 0)
+    return header + question + opt
+
+
+def _read_name(data: bytes, offset: int) -> tuple[str, int]:
+    """讀取 (可能壓縮的) 網域名稱，返回 (名稱, 之後的位移)"""
+    labels = []
+    end = -1
+    hops = 0
+    while True:
+        if offset >= len(data):
+            raise DNSError("truncated name")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data) or hops > 64:
+                raise DNSError("bad compression pointer")
+            if end < 0:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            hops += 1
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode("ascii", "replace"))
+        offset += length
+    return ".".join(labels).lower(), (end if end >= 0 else offset)
+
+
+def parse_response(data: bytes) -> DNSResponse:
+    """解析回應封包中的 A / AAAA 記錄與否定 TTL"""
+    if len(data) < 12:
+        raise DNSError("short response")
+    qid, flags, qdcount, ancount, nscount, _ = struct.unpack_from("!HHHHHH", data)
+    response = DNSResponse(qid=qid, rcode=flags & 0x000F, truncated=bool(flags & 0x0200))
+
+    offset = 12
+    for _ in range(qdcount):
+        response.qname, offset = _read_name(data, offset)
+        if offset + 4 > len(data):
+            raise DNSError("truncated question")
+        response.qtype = struct.unpack_from("!H", data, offset)[0]
+        offset += 4
+
+    ttls = []
+    negative_ttl = None
+    for index in range(ancount + nscount):
+        _, offset = _read_name(data, offset)
+        if offset + 10 > len(data):
+            raise DNSError("truncated record")
+        rtype, _, ttl, rdlength = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        rdata = data[offset:offset + rdlength]
+        offset += rdlength
+        if len(rdata) != rdlength:
+            raise DNSError("truncated rdata")
+
+        if index < ancount:
+            if rtype == QTYPE_A and rdlength == 4:
+                response.addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+                ttls.append(ttl)
+            elif rtype == QTYPE_AAAA and rdlength == 16:
+                response.addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+                ttls.append(ttl)
+            elif rtype == QTYPE_CNAME:
+                ttls.append(ttl)
+        elif rtype == QTYPE_SOA and rdlength >= 20:
+            # RFC 2308: 否定快取時間為 min(SOA TTL, SOA MINIMUM)
+            minimum = struct.unpack_from("!I", rdata, rdlength - 4)[0]
+            negative_ttl = min(ttl, minimum)
+
+    if response.addresses:
+        response.ttl = min(ttls)
+    elif negative_ttl is not None:
+        response.ttl = negative_ttl
+    return response
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    """單一 UDP socket，以查詢 ID 對應回應"""
+
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: dict[int, asyncio.Future] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 2:
+            return
+        future = self.pending.pop(struct.unpack_from("!H", data)[0], None)
+        if future and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        # ICMP 不可達等錯誤無法對應到查詢，交給逾時處理
+        pass
+
+    def connection_lost(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(DNSError("socket closed"))
+        self.pending.clear()
+
+
+class _StreamConnection:
+    """長度前綴的 TCP / TLS 連線，單一連線上管線化多個查詢"""
+
+    def __init__(self, host: str, port: int, ssl_context: Optional[ssl.SSLContext] = None,
+                 server_hostname: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.server_hostname = server_hostname
+        self.pending: dict[int, asyncio.Future] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        async with self._lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            reader, self._writer = await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl_context,
+                server_hostname=self.server_hostname if self.ssl_context else None
+            )
+            self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+                data = await reader.readexactly(length)
+                future = self.pending.pop(struct.unpack_from("!H", data)[0], None)
+                if future and not future.done():
+                    future.set_result(data)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, struct.error):
+            pass
+        finally:
+            self._fail_pending(DNSError("connection closed"))
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _fail_pending(self, exc: Exception):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+    async def query(self, qid: int, packet: bytes) -> bytes:
+        await self._connect()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[qid] = future
+        try:
+            self._writer.write(struct.pack("!H", len(packet)) + packet)
+            return await future
+        finally:
+            self.pending.pop(qid, None)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def parse_upstream(upstream: str, default_port: int) -> tuple[str, int]:
+    """解析 "ip"、"ip:port" 或 "[ipv6]:port" """
+    if upstream.startswith("["):
+        host, _, port = upstream[1:].partition("]")
+        return host, int(port.lstrip(":") or default_port)
+    if upstream.count(":") == 1:
+        host, port = upstream.split(":")
+        return host, int(port)
+    return upstream, default_port
+
+
+def system_nameservers(path: str = "/etc/resolv.conf") -> list[str]:
+    """讀取系統設定的 DNS 伺服器"""
+    servers = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    servers.append(parts[1])
+    except OSError:
+        pass
+    return servers
+
+
+def read_hosts(path: str = "/etc/hosts") -> dict[str, list[str]]:
+    """讀取 hosts 文件，返回 {主機名: [位址]} (getaddrinfo 會先查這裡)"""
+    hosts: dict[str, list[str]] = {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                parts = line.split("#", 1)[0].split()
+                if len(parts) < 2:
+                    continue
+                ip = parts[0].split("%", 1)[0]
+                try:
+                    socket.inet_pton(socket.AF_INET6 if ":" in ip else socket.AF_INET, ip)
+                except OSError:
+                    continue
+                for name in parts[1:]:
+                    addrs = hosts.setdefault(name.rstrip(".").lower(), [])
+                    if ip not in addrs:
+                        addrs.append(ip)
+    except OSError:
+        pass
+    return hosts
+
+
+class AsyncResolver:
+    """非阻塞 DNS 解析器
+
+    transport: "udp" (預設，截斷時改用 TCP)、"tcp"、"dot" 或 "doh"。
+    """
+
+    PORTS = {"udp": 53, "tcp": 53, "dot": 853}
+
+    def __init__(self, upstreams: Optional[list[str]] = None, transport: str = "udp",
+                 timeout: float = 2.0, retries: int = 2,
+                 doh_url: str = "https://cloudflare-dns.com/dns-query",
+                 tls_server_name: str = "", hosts_file: Optional[str] = "/etc/hosts"):
+        if transport not in ("udp", "tcp", "dot", "doh"):
+            raise ValueError(f"unknown DNS transport {transport!r}")
+        self.transport = transport
+        self.timeout = timeout
+        self.retries = retries
+        self.doh_url = doh_url
+        self.tls_server_name = tls_server_name
+        port = self.PORTS.get(transport, 53)
+        upstreams = upstreams or system_nameservers() or ["1.1.1.1", "8.8.8.8"]
+        self.upstreams = [parse_upstream(u, port) for u in upstreams]
+        self.hosts = read_hosts(hosts_file) if hosts_file else {}
+
+        self._udp: dict[tuple[str, int], list[_UDPProtocol]] = {}
+        self._udp_slots: dict[tuple[str, int], asyncio.Semaphore] = {}
+        self._udp_lock = asyncio.Lock()
+        self._streams: dict[tuple[str, int, bool], _StreamConnection] = {}
+        self._doh_session: Optional[aiohttp.ClientSession] = None
+
+    @staticmethod
+    def _alive(protocol: _UDPProtocol) -> bool:
+        return protocol.transport is not None and not protocol.transport.is_closing()
+
+    async def _open_udp(self, upstream: tuple[str, int]) -> _UDPProtocol:
+        sock = socket.socket(socket.AF_INET6 if ":" in upstream[0] else socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            # 核心可能把數值限制在 net.core.rmem_max，實際保護來自 UDP_MAX_INFLIGHT
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+            sock.connect(upstream)
+        except OSError:
+            sock.close()
+            raise
+        _, protocol = await asyncio.get_running_loop().create_datagram_endpoint(_UDPProtocol, sock=sock)
+        return protocol
+
+    async def _udp_protocol(self, upstream: tuple[str, int]) -> _UDPProtocol:
+        """從上游的 socket 池中挑選進行中查詢最少的一個"""
+        pool = self._udp.get(upstream, [])
+        if len(pool) < UDP_SOCKETS or not all(self._alive(p) for p in pool):
+            async with self._udp_lock:
+                pool = [p for p in self._udp.get(upstream, []) if self._alive(p)]
+                while len(pool) < UDP_SOCKETS:
+                    pool.append(await self._open_udp(upstream))
+                self._udp[upstream] = pool
+        return min(pool, key=lambda p: len(p.pending))
+
+    def _udp_slot(self, upstream: tuple[str, int]) -> asyncio.Semaphore:
+        slot = self._udp_slots.get(upstream)
+        if slot is None:
+            slot = self._udp_slots[upstream] = asyncio.Semaphore(UDP_SOCKETS * UDP_MAX_INFLIGHT)
+        return slot
+
+    def _stream(self, upstream: tuple[str, int], use_tls: bool) -> _StreamConnection:
+        key = (upstream[0], upstream[1], use_tls)
+        conn = self._streams.get(key)
+        if conn is None:
+            context = None
+            if use_tls:
+                context = ssl.create_default_context()
+                if not self.tls_server_name:
+                    # 以 IP 連線時無法驗證主機名，仍驗證憑證鏈
+                    context.check_hostname = False
+            conn = _StreamConnection(upstream[0], upstream[1], context, self.tls_server_name or None)
+            self._streams[key] = conn
+        return conn
+
+    @staticmethod
+    def _new_id(pending: dict) -> int:
+        while True:
+            qid = random.getrandbits(16)
+            if qid not in pending:
+                return qid
+
+    async def _exchange(self, upstream: tuple[str, int], name: str, qtype: int) -> DNSResponse:
+        """向單一上游發出一次查詢"""
+        if self.transport == "doh":
+            packet = build_query(0, name, qtype)
+            if self._doh_session is None or self._doh_session.closed:
+                self._doh_session = aiohttp.ClientSession()
+            async with self._doh_session.post(
+                self.doh_url, data=packet,
+                headers={"Content-Type": "application/dns-message", "Accept": "application/dns-message"}
+            ) as resp:
+                if resp.status != 200:
+                    raise DNSError(f"DoH HTTP {resp.status}")
+                return parse_response(await resp.read())
+
+        if self.transport == "udp":
+            protocol = await self._udp_protocol(upstream)
+            qid = self._new_id(protocol.pending)
+            packet = build_query(qid, name, qtype)
+            future = asyncio.get_running_loop().create_future()
+            protocol.pending[qid] = future
+            try:
+                protocol.transport.sendto(packet)
+                response = parse_response(await future)
+            finally:
+                protocol.pending.pop(qid, None)
+            if not response.truncated:
+                return response
+            # 回應被截斷，改用 TCP 重新查詢
+
+        conn = self._stream(upstream, use_tls=self.transport == "dot")
+        qid = self._new_id(conn.pending)
+        return parse_response(await conn.query(qid, build_query(qid, name, qtype)))
+
+    async def query(self, name: str, qtype: int) -> DNSResponse:
+        """查詢單一記錄類型；逾時或伺服器錯誤時換下一個上游重試"""
+        name = name.rstrip(".").lower()
+        try:
+            expected = name if name.isascii() else name.encode("idna").decode("ascii")
+        except UnicodeError:
+            raise DNSError(f"invalid name {name!r}")
+        last_error: Exception = DNSError("no upstream")
+        for attempt in range(self.retries + 1):
+            upstream = self.upstreams[attempt % len(self.upstreams)]
+            # 等待 UDP 名額的時間不計入逾時
+            slot = self._udp_slot(upstream) if self.transport == "udp" else contextlib.nullcontext()
+            try:
+                async with slot:
+                    response = await asyncio.wait_for(self._exchange(upstream, name, qtype), self.timeout)
+            except (asyncio.TimeoutError, OSError, aiohttp.ClientError, DNSError) as e:
+                last_error = e
+                continue
+            if response.qname != expected or response.qtype != qtype:
+                last_error = DNSError("mismatched response")
+                continue
+            if response.rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                return response
+            last_error = DNSError(f"rcode {response.rcode}")
+        raise last_error
+
+    async def resolve(self, host: str) -> tuple[list[str], int]:
+        """並行查詢 A 與 AAAA，返回 (位址, TTL)；否定回應的 TTL 取自 SOA
+
+        hosts 文件中的名稱直接返回，與 getaddrinfo 一致。
+        """
+        addrs = self.hosts.get(host.rstrip(".").lower())
+        if addrs:
+            return list(addrs), HOSTS_TTL
+        results = await asyncio.gather(
+            self.query(host, QTYPE_A),
+            self.query(host, QTYPE_AAAA),
+            return_exceptions=True
+        )
+        responses = [r for r in results if isinstance(r, DNSResponse)]
+        addrs = [ip for r in responses for ip in r.addresses]
+        if not addrs:
+            # 其中一個查詢失敗時無法確定名稱不存在，不當作否定回應
+            for r in results:
+                if isinstance(r, BaseException):
+                    raise r
+        if addrs:
+            ttl = min(r.ttl for r in responses if r.addresses)
+        else:
+            ttl = min((r.ttl for r in responses if r.ttl), default=DEFAULT_NEGATIVE_TTL)
+        return addrs, ttl
+
+    async def close(self):
+        """關閉所有 socket 與連線"""
+        for pool in self._udp.values():
+            for protocol in pool:
+                if protocol.transport:
+                    protocol.transport.close()
+        self._udp.clear()
+        for conn in self._streams.values():
+            await conn.close()
+        self._streams.clear()
+        if self._doh_session is not None:
+            await self._doh_session.close()
+            self._doh_session = None
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+節點測試歷史 - SQLite (WAL) 保存每個節點的測試記錄，支援增量重測
+
+最近測試過且結果穩定的節點不再重新探測：
+穩定通過的節點直接沿用上次結果，穩定失敗的節點依連續失敗次數指數延後重測。
+"""
+
+import time
+import sqlite3
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+# 測試計畫
+TEST = "test"      # 需要探測
+REUSE = "reuse"    # 穩定通過，沿用上次結果
+SKIP = "skip"      # 穩定失敗，本次略過
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS node_history (
+    node_id      TEXT PRIMARY KEY,
+    last_tested  REAL NOT NULL,
+    pass_streak  INTEGER NOT NULL DEFAULT 0,
+    fail_streak  INTEGER NOT NULL DEFAULT 0,
+    latency_ewma REAL,
+    last_error   TEXT NOT NULL DEFAULT '',
+    last_result  TEXT
+)
+"""
+
+COLUMNS = "node_id, last_tested, pass_streak, fail_streak, latency_ewma, last_error, last_result"
+
+# 以 SQL 累加連續次數與延遲 EWMA，批次寫入時不需要先讀取舊值
+UPSERT = """
+INSERT INTO node_history (node_id, last_tested, pass_streak, fail_streak, latency_ewma, last_error, last_result)
+VALUES (:node_id, :now, :passed, 1 - :passed, :latency, :error, :result)
+ON CONFLICT(node_id) DO UPDATE SET
+    last_tested  = excluded.last_tested,
+    pass_streak  = CASE WHEN :passed THEN pass_streak + 1 ELSE 0 END,
+    fail_streak  = CASE WHEN :passed THEN 0 ELSE fail_streak + 1 END,
+    latency_ewma = CASE
+        WHEN excluded.latency_ewma IS NULL THEN latency_ewma
+        WHEN latency_ewma IS NULL THEN excluded.latency_ewma
+        ELSE latency_ewma + :alpha * (excluded.latency_ewma - latency_ewma)
+    END,
+    last_error   = excluded.last_error,
+    last_result  = COALESCE(excluded.last_result, last_result)
+"""
+
+
+@dataclass(slots=True)
+class HistoryEntry:
+    """單一節點的歷史記錄"""
+    node_id: str
+    last_tested: float
+    pass_streak: int
+    fail_streak: int
+    latency_ewma: Optional[float]
+    last_error: str
+    last_result: Optional[str]  # 最近一次通過時的 test_result (JSON)
+
+
+class TestHistory:
+    """測試歷史存取；寫入先緩衝，每 batch_size 筆一次交易"""
+
+    def __init__(self, path: str = "cache/history.sqlite3", recheck_hours: float = 36,
+                 stable_streak: int = 3, max_backoff_hours: float = 168,
+                 ewma_alpha: float = 0.3, batch_size: int = 500):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.recheck = recheck_hours * 3600
+        self.stable_streak = max(1, stable_streak)
+        self.max_backoff = max_backoff_hours * 3600
+        self.ewma_alpha = ewma_alpha
+        self.batch_size = batch_size
+        self._pending: list[dict] = []
+        # preload 載入的記錄；不在 _preloaded 中的節點才逐筆查詢
+        self._entries: dict[str, HistoryEntry] = {}
+        self._preloaded: set[str] = set()
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def preload(self, node_ids: Iterable[str]):
+        """以一次查詢載入這批節點的歷史記錄，之後的 get / plan / priority 不再逐筆查詢"""
+        self._preloaded = set(node_ids)
+        # 節點 ID 放進臨時表後以 JOIN 取出，只讀取需要的記錄
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (node_id TEXT PRIMARY KEY)")
+        self.conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((node_id,) for node_id in self._preloaded))
+        rows = self.conn.execute(
+            f"SELECT {COLUMNS} FROM node_history JOIN wanted USING (node_id)"
+        ).fetchall()
+        self.conn.execute("DELETE FROM wanted")
+        self.conn.commit()
+        self._entries = {row[0]: HistoryEntry(*row) for row in rows}
+
+    def unload(self):
+        """釋放 preload 載入的記錄"""
+        self._entries = {}
+        self._preloaded = set()
+
+    def get(self, node_id: str) -> Optional[HistoryEntry]:
+        if node_id in self._preloaded:
+            return self._entries.get(node_id)
+        row = self.conn.execute(
+            f"SELECT {COLUMNS} FROM node_history WHERE node_id = ?", (node_id,)
+        ).fetchone()
+        return HistoryEntry(*row) if row else None
+
+    def plan(self, node_id: str, now: Optional[float] = None) -> tuple[str, Optional[HistoryEntry]]:
+        """決定本次是否需要探測，返回 (TEST / REUSE / SKIP, 歷史記錄)"""
+        entry = self.get(node_id)
+        if entry is None:
+            return TEST, None
+        age = (now or time.time()) - entry.last_tested
+
+        if entry.pass_streak >= self.stable_streak and entry.last_result and age < self.recheck:
+            return REUSE, entry
+        if entry.fail_streak >= self.stable_streak:
+            # 連續失敗越多次，重測間隔越長
+            backoff = min(self.recheck * 2 ** (entry.fail_streak - self.stable_streak), self.max_backoff)
+            if age < backoff:
+                return SKIP, entry
+        return TEST, entry
+
+    def priority(self, node_id: str, now: Optional[float] = None) -> int:
+        """排程優先順序 (越小越先測)：新節點 0、結果不穩定 1、穩定但已過期 2"""
+        entry = self.get(node_id)
+        if entry is None:
+            return 0
+        if max(entry.pass_streak, entry.fail_streak) < self.stable_streak:
+            return 1
+        return 2
+
+    def record(self, node_id: str, passed: bool, latency_ms: Optional[float],
+               error: str = "", result: Optional[str] = None):
+        """記錄一次測試結果；result 為通過時的 test_result JSON"""
+        self._pending.append({
+            "node_id": node_id,
+            "now": time.time(),
+            "passed": int(passed),
+            "latency": latency_ms,
+            "error": error,
+            "result": result,
+            "alpha": self.ewma_alpha
+        })
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany(UPSERT, self._pending)
+        self._pending.clear()
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """刪除超過最長重測間隔仍未測試的記錄 (節點已不在訂閱來源中)，返回刪除筆數"""
+        cutoff = (now or time.time()) - max(self.max_backoff, self.recheck)
+        with self.conn:
+            return self.conn.execute("DELETE FROM node_history WHERE last_tested < ?", (cutoff,)).rowcount
+
+    def close(self):
+        self.flush()
+        self.prune()
+        self.conn.close()
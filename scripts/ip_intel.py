@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+IP 情報查詢 - 批次請求、依回應標頭限速、多個提供者依序備援
+
+ip-api.com 的批次端點一次可查 100 個 IP，免費額度以 X-Rl (剩餘請求數)
+與 X-Ttl (距離重置秒數) 回報；令牌桶依這兩個標頭調整節奏。
+提供者的 base_url 可設定，方便以本地替身伺服器測試。
+"""
+
+import json
+import time
+import asyncio
+import aiohttp
+import ipaddress
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Optional
+
+from asn_db import DEFAULT_PATH as DEFAULT_ASN_DB_PATH, ASNDatabase
+
+IP_API_FIELDS = "status,message,countryCode,org,as,hosting,proxy,query"
+
+# 同一網段推斷時沿用的欄位 (is_vpn 因 IP 而異，不推斷)
+PREFIX_FIELDS = ("country", "asn", "org", "is_datacenter")
+
+
+class TokenBucket:
+    """令牌桶限速；伺服器回報額度用盡時暫停到重置時間"""
+
+    def __init__(self, requests_per_minute: float):
+        self.rate = max(requests_per_minute, 0.001) / 60
+        self.capacity = max(1.0, requests_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update(self, remaining: Optional[int], reset_seconds: Optional[float]):
+        """依伺服器回報的剩餘額度校正"""
+        now = time.monotonic()
+        self._refill(now)
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0 and reset_seconds:
+                self.blocked_until = now + reset_seconds
+
+
+def _header_number(headers, name: str) -> Optional[int]:
+    try:
+        return int(headers.get(name, ""))
+    except ValueError:
+        return None
+
+
+def _parse_asn(as_str: str) -> int:
+    """'AS13335 Cloudflare, Inc.' -> 13335"""
+    try:
+        return int(as_str.split()[0].upper().replace("AS", ""))
+    except (IndexError, ValueError):
+        return 0
+
+
+class IPIntelProvider(ABC):
+    """提供者基底類別；fetch 返回 {ip: 情報}，查不到的 IP 不出現在結果中"""
+
+    name = ""
+    batch_size = 1
+
+    def __init__(self, base_url: str, requests_per_minute: float = 45, timeout: float = 10):
+        self.base_url = base_url.rstrip("/")
+        self.bucket = TokenBucket(requests_per_minute)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+    @abstractmethod
+    async def fetch(self, session: aiohttp.ClientSession, ips: list[str]) -> dict[str, dict]:
+        ...
+
+
+class IPApiProvider(IPIntelProvider):
+    """ip-api.com 批次端點 (POST /batch，最多 100 個 IP)"""
+
+    name = "ip-api"
+    batch_size = 100
+
+    def __init__(self, base_url: str = "http://ip-api.com", requests_per_minute: float = 15,
+                 timeout: float = 10, retries: int = 5):
+        super().__init__(base_url, requests_per_minute, timeout)
+        self.retries = retries
+        # 批次請求逐一送出，X-Rl 才能反映下一個請求前的真實剩餘額度
+        self._lock = asyncio.Lock()
+
+    async def fetch(self, session: aiohttp.ClientSession, ips: list[str]) -> dict[str, dict]:
+        async with self._lock:
+            return await self._fetch(session, ips)
+
+    async def _fetch(self, session: aiohttp.ClientSession, ips: list[str]) -> dict[str, dict]:
+        for _ in range(self.retries + 1):
+            await self.bucket.acquire()
+            async with session.post(
+                f"{self.base_url}/batch?fields={IP_API_FIELDS}",
+                json=[{"query": ip} for ip in ips],
+                timeout=self.timeout
+            ) as resp:
+                self.bucket.update(_header_number(resp.headers, "X-Rl"),
+                                   _header_number(resp.headers, "X-Ttl"))
+                if resp.status == 429:
+                    # 超出額度：令牌桶已暫停到重置時間，重試
+                    if self.bucket.blocked_until <= time.monotonic():
+                        self.bucket.update(0, 60)
+                    continue
+                if resp.status != 200:
+                    return {}
+                data = await resp.json(content_type=None)
+            break
+        else:
+            return {}
+
+        results = {}
+        for item in data:
+            ip = item.get("query")
+            if not ip:
+                continue
+            if item.get("status") == "success":
+                results[ip] = {
+                    "country": item.get("countryCode", ""),
+                    "asn": _parse_asn(item.get("as", "")),
+                    "org": item.get("org", ""),
+                    "is_datacenter": bool(item.get("hosting", False)),
+                    "is_vpn": bool(item.get("proxy", False))
+                }
+            elif item.get("message") in ("private range", "reserved range"):
+                # 明確的否定結果，不需要交給備援提供者
+                results[ip] = {"error": item["message"]}
+        return results
+
+
+class IPWhoisProvider(IPIntelProvider):
+    """ipwho.is (每次一個 IP，沒有 hosting 欄位)"""
+
+    name = "ipwhois"
+
+    def __init__(self, base_url: str = "https://ipwho.is", requests_per_minute: float = 60,
+                 timeout: float = 10):
+        super().__init__(base_url, requests_per_minute, timeout)
+
+    async def _fetch_one(self, session: aiohttp.ClientSession, ip: str) -> Optional[dict]:
+        await self.bucket.acquire()
+        try:
+            async with session.get(f"{self.base_url}/{ip}", timeout=self.timeout) as resp:
+                if resp.status != 200:
+                    return None
+                data = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+        if not data.get("success"):
+            return None
+        connection = data.get("connection") or {}
+        return {
+            "country": data.get("country_code", ""),
+            "asn": int(connection.get("asn") or 0),
+            "org": connection.get("org") or connection.get("isp", ""),
+            "is_datacenter": False,
+            "is_vpn": bool((data.get("security") or {}).get("vpn", False))
+        }
+
+    async def fetch(self, session: aiohttp.ClientSession, ips: list[str]) -> dict[str, dict]:
+        infos = await asyncio.gather(*(self._fetch_one(session, ip) for ip in ips))
+        return {ip: info for ip, info in zip(ips, infos) if info}
+
+
+class ASNDatabaseProvider(IPIntelProvider):
+    """離線 ASN 資料庫 (見 asn_db.py)，不經過網路；資料庫不存在時所有 IP 交給下一個提供者
+
+    資料庫沒有 VPN 資訊：vpn_fallback 開啟時 is_vpn 標為未知 (None)，
+    由後面的線上提供者補上 (IPIntelClient 的 vpn_filter 可限制哪些 IP 需要補)；
+    關閉時直接視為非 VPN (block_vpn_detected 對這些 IP 無效)。
+    """
+
+    name = "asn-db"
+    batch_size = 1000
+
+    def __init__(self, path: str = DEFAULT_ASN_DB_PATH, max_age_hours: float = 24 * 30,
+                 vpn_fallback: bool = True):
+        super().__init__("", requests_per_minute=0)
+        self.vpn_fallback = vpn_fallback
+        self.db: Optional[ASNDatabase] = None
+        try:
+            self.db = ASNDatabase(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ℹ ASN 資料庫無法使用 ({e})，改用線上查詢")
+            return
+        if self.db.age_hours() > max_age_hours:
+            print(f"⚠ ASN 資料庫已 {int(self.db.age_hours() / 24)} 天未更新")
+
+    async def fetch(self, session: aiohttp.ClientSession, ips: list[str]) -> dict[str, dict]:
+        if self.db is None:
+            return {}
+        results = {}
+        for ip in ips:
+            info = self.db.lookup(ip)
+            if info:
+                if self.vpn_fallback:
+                    info["is_vpn"] = None
+                results[ip] = info
+        return results
+
+
+PROVIDERS = {
+    ASNDatabaseProvider.name: ASNDatabaseProvider,
+    IPApiProvider.name: IPApiProvider,
+    IPWhoisProvider.name: IPWhoisProvider,
+}
+
+
+def build_providers(configs: list[dict]) -> list[IPIntelProvider]:
+    """依設定建立提供者列表，例如 [{"name": "ip-api", "base_url": "...", "requests_per_minute": 15}]"""
+    providers = []
+    for config in configs:
+        config = {k: v for k, v in config.items() if k != "comment"}
+        if not config.pop("enabled", True):
+            continue
+        cls = PROVIDERS.get(config.pop("name", ""))
+        if cls:
+            providers.append(cls(**config))
+    return providers
+
+
+class IPIntelClient:
+    """批次查詢客戶端：收集短時間內的查詢合併成批次，依序嘗試各提供者"""
+
+    def __init__(self, providers: Optional[list[IPIntelProvider]] = None, batch_delay: float = 0.05,
+                 vpn_filter: Optional[Callable[[dict], bool]] = None):
+        self.providers = providers or [IPApiProvider()]
+        self.batch_delay = batch_delay
+        # VPN 未知的結果是否值得交給下一個提供者；None 表示全部交給
+        self.vpn_filter = vpn_filter
+        self.batch_size = max(p.batch_size for p in self.providers)
+        self.requests = 0
+        self._queue: list[tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def lookup(self, ip: str) -> dict:
+        """查詢單一 IP；失敗時返回帶 error 的字典
+
+        同一 IP 的並發查詢由呼叫者以 SingleFlight 合併，這裡只負責湊批次。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((ip, future))
+        if len(self._queue) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            task = asyncio.get_running_loop().create_task(self._resolve(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, batch: list[tuple[str, asyncio.Future]]):
+        results: dict[str, dict] = {}
+        last_error = "lookup failed"
+        try:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession()
+            remaining = list(dict.fromkeys(ip for ip, _ in batch))
+            for provider in self.providers:
+                for start in range(0, len(remaining), provider.batch_size):
+                    chunk = remaining[start:start + provider.batch_size]
+                    self.requests += 1
+                    try:
+                        fetched = await provider.fetch(self._session, chunk)
+                    except Exception as e:
+                        last_error = f"{provider.name}: {e}"
+                        continue
+                    for ip, info in fetched.items():
+                        if ip not in results or "error" in results[ip]:
+                            results[ip] = info
+                        elif "error" not in info:
+                            # 已有離線結果，只補上 VPN 判斷
+                            results[ip]["is_vpn"] = info.get("is_vpn", False)
+                # 查不到或 VPN 未知的 IP 繼續交給下一個提供者
+                remaining = [ip for ip in remaining if ip not in results or self._needs_vpn(results[ip])]
+                if not remaining:
+                    break
+        except asyncio.CancelledError:
+            last_error = "client closed"
+            raise
+        finally:
+            # 被 close() 取消時也要讓等待者拿到結果
+            for ip, future in batch:
+                if not future.done():
+                    future.set_result(results.get(ip) or {"error": last_error})
+
+    def _needs_vpn(self, info: dict) -> bool:
+        if "error" in info:
+            return True
+        return info.get("is_vpn") is None and (self.vpn_filter is None or self.vpn_filter(info))
+
+    async def close(self, timeout: float = 5):
+        """關閉客戶端；進行中的批次最多再等 timeout 秒 (令牌桶可能要等上好幾分鐘)，之後取消
+        
+        被取消的查詢返回帶 error 的結果。
+        """
+        self._flush()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def prefix_of(ip: str) -> str:
+    """IP 所屬的網段 (IPv4 /24、IPv6 /48)，作為同網段推斷的鍵"""
+    addr = ipaddress.ip_address(ip)
+    length = 24 if addr.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{length}", strict=False))
+
+
+class IPIntelCache:
+    """跨次執行的 IP 情報快取
+
+    - ttl 內為新鮮結果；超過 ttl 但未超過 ttl + stale 時仍返回舊結果，由呼叫者在背景重新查詢
+    - 沒查過的 IP 可從同網段已查過的結果推斷 ASN 與國家 (網段內 ASN 不一致時不推斷)；
+      推斷結果的 is_vpn 為 None (未知)，需要 VPN 判斷時應關閉 infer_prefix
+    """
+
+    MIXED = "mixed"
+
+    def __init__(self, path: str = "cache/ip_intel.json", ttl_hours: float = 168,
+                 stale_hours: float = 720, infer_prefix: bool = True):
+        self.path = Path(path)
+        self.ttl = ttl_hours * 3600
+        self.stale = stale_hours * 3600
+        self.infer_prefix = infer_prefix
+        self.ips: dict[str, dict] = {}       # ip -> {"info": {...}, "fetched": ts}
+        self.prefixes: dict[str, dict] = {}  # 網段 -> {"info": {...} 或 "mixed", "fetched": ts}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.ips = data.get("ips", {})
+            self.prefixes = data.get("prefixes", {})
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def _age(self, entry: dict) -> float:
+        return time.time() - entry["fetched"]
+
+    def get(self, ip: str) -> tuple[Optional[dict], bool]:
+        """返回 (情報, 是否過期需要重新查詢)；查無可用結果時情報為 None"""
+        entry = self.ips.get(ip)
+        if entry and self._age(entry) < self.ttl + self.stale:
+            return entry["info"], self._age(entry) >= self.ttl
+
+        if self.infer_prefix:
+            entry = self.prefixes.get(prefix_of(ip))
+            if entry and entry["info"] != self.MIXED and self._age(entry) < self.ttl:
+                # is_vpn 因 IP 而異，推斷結果標為未知
+                return dict(entry["info"], is_vpn=None, inferred=True), False
+        return None, False
+
+    def put(self, ip: str, info: dict):
+        """寫入查詢成功的結果，同時更新網段記錄"""
+        now = time.time()
+        self.ips[ip] = {"info": info, "fetched": now}
+
+        prefix = prefix_of(ip)
+        summary = {key: info.get(key) for key in PREFIX_FIELDS}
+        entry = self.prefixes.get(prefix)
+        if entry and entry["info"] != self.MIXED and self._age(entry) < self.ttl \
+                and entry["info"]["asn"] != summary["asn"]:
+            # 同一網段出現不同 ASN，不再用於推斷
+            summary = self.MIXED
+        elif entry and entry["info"] == self.MIXED and self._age(entry) < self.ttl:
+            summary = self.MIXED
+        self.prefixes[prefix] = {"info": summary, "fetched": now}
+
+    def save(self):
+        """寫回文件，清除超過 ttl + stale 的條目"""
+        limit = self.ttl + self.stale
+        ips = {ip: e for ip, e in self.ips.items() if self._age(e) < limit}
+        prefixes = {p: e for p, e in self.prefixes.items() if self._age(e) < limit}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({"ips": ips, "prefixes": prefixes}, f, ensure_ascii=False)
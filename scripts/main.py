@@ -17,22 +17,35 @@ async def main():
     print("=" * 60)
     print()
     
-    # Step 1: 聚合節點
-    print("📥 Step 1/3: 聚合節點")
+    # Step 1-2: 聚合並測試節點 (流水線：解析出的節點立即進入測試)
+    print("📥 Step 1-2/3: 聚合並測試節點")
     print("-" * 40)
     from aggregate import NodeAggregator
-    aggregator = NodeAggregator()
-    nodes = await aggregator.aggregate()
-    aggregator.save_nodes(nodes)
-    print()
-    
-    # Step 2: 測試節點
-    print("🔬 Step 2/3: 測試節點")
-    print("-" * 40)
     from test_nodes import NodeTester
+    from artifacts import rewrite_records
+    aggregator = NodeAggregator()
     tester = NodeTester()
-    passed_nodes = await tester.test_all([n.__dict__ if hasattr(n, '__dict__') else n for n in nodes])
-    tester.save_results(passed_nodes)
+    queue = asyncio.Queue(maxsize=tester.queue_size)
+    # 通過的節點在探測完成時立即寫入 tested_nodes.ndjson
+    writer = tester.open_results()
+    try:
+        nodes, _ = await asyncio.gather(
+            aggregator.stream(queue),
+            tester.test_stream(queue, writer)
+        )
+    finally:
+        writer.close()
+        await tester.close()
+    aggregator.save_nodes(nodes)
+    if aggregator.index.replaced:
+        # 測試期間出現了優先級更高的重複節點，去重結束後把結果改為索引中的版本
+        def prefer_indexed(record: dict) -> dict:
+            node = aggregator.index.get(record.get("unique_id", ""))
+            return dict(record, **node.to_dict()) if node else record
+        
+        changed = rewrite_records(writer.path, prefer_indexed)
+        print(f"✓ 已依合併優先級更新 {changed} 筆測試結果")
+    print(f"✓ 測試結果已保存到 {writer.path}")
     print()
     
     # Step 3: 生成訂閱
@@ -10,9 +10,14 @@ import asyncio
 import aiohttp
 from pathlib import Path
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, Optional
 from urllib.parse import quote
 
+from aggregate import NodeParser, ProxyNode
+from artifacts import RAW_NODES_PATH, TESTED_NODES_PATH, iter_records, read_summary
+from selection import merge_sorted, top_k
+from test_nodes import TestResult
+
 
 class SubscriptionMerger:
     """訂閱合併器"""
@@ -25,8 +30,10 @@ class SubscriptionMerger:
         
         self.output_config = self.settings.get("output", {})
         self.max_nodes = self.output_config.get("max_nodes", 200)
+        # 排序用的延遲: "tls" = TCP + TLS 握手完成時間，"tcp" = 只看 TCP 連線
+        self.rank_latency = self.output_config.get("rank_latency", "tls")
     
-    async def fetch_bpb_subscription(self) -> list[dict]:
+    async def fetch_bpb_subscription(self) -> list[ProxyNode]:
         """獲取 BPB Panel 訂閱"""
         bpb_config = self.sources.get("bpb_panel", {})
         if not bpb_config.get("enabled") or not bpb_config.get("subscription_url"):
@@ -44,21 +51,18 @@ class SubscriptionMerger:
                         # BPB Panel 可能返回不同格式，這裡嘗試解析
                         try:
                             # 嘗試 JSON (sing-box 格式)
-                            data = json.loads(content)
-                            print(f"✓ BPB Panel: 已獲取 sing-box 配置")
-                            return [{"type": "singbox_config", "data": data, "source": "bpb", "priority": 0}]
+                            json.loads(content)
+                            print(f"⚠ BPB Panel: 返回 sing-box 配置，無法合併為節點")
+                            return []
                         except:
                             pass
                         
                         # 嘗試解析為普通節點列表
-                        from aggregate import NodeParser
                         lines = content.strip().split('\n')
                         for line in lines:
                             node = NodeParser.parse_line(line)
                             if node:
-                                node.source = "bpb"
-                                node.priority = 0
-                                nodes.append(node.__dict__)
+                                nodes.append(node.with_source("bpb", 0))
                         
                         print(f"✓ BPB Panel: {len(nodes)} 個節點")
         except Exception as e:
@@ -66,33 +70,33 @@ class SubscriptionMerger:
         
         return nodes
     
-    def node_to_singbox_outbound(self, node: dict, tag: str) -> Optional[dict]:
+    def node_to_singbox_outbound(self, node: ProxyNode, tag: str) -> Optional[dict]:
         """將節點轉換為 sing-box outbound"""
-        protocol = node.get("protocol", "")
+        protocol = node.protocol
         
         if protocol == "vmess":
             return {
                 "type": "vmess",
                 "tag": tag,
-                "server": node.get("address"),
-                "server_port": node.get("port"),
-                "uuid": node.get("uuid_or_password"),
+                "server": node.address,
+                "server_port": node.port,
+                "uuid": node.uuid_or_password,
                 "security": "auto",
                 "alter_id": 0,
                 "transport": self._get_transport(node),
-                "tls": self._get_tls(node) if node.get("tls") else None
+                "tls": self._get_tls(node) if node.tls else None
             }
         
         elif protocol == "vless":
             outbound = {
                 "type": "vless",
                 "tag": tag,
-                "server": node.get("address"),
-                "server_port": node.get("port"),
-                "uuid": node.get("uuid_or_password"),
+                "server": node.address,
+                "server_port": node.port,
+                "uuid": node.uuid_or_password,
                 "transport": self._get_transport(node),
             }
-            if node.get("tls"):
+            if node.tls:
                 outbound["tls"] = self._get_tls(node)
             return outbound
         
@@ -100,79 +104,79 @@ class SubscriptionMerger:
             return {
                 "type": "trojan",
                 "tag": tag,
-                "server": node.get("address"),
-                "server_port": node.get("port"),
-                "password": node.get("uuid_or_password"),
+                "server": node.address,
+                "server_port": node.port,
+                "password": node.uuid_or_password,
                 "tls": self._get_tls(node),
-                "transport": self._get_transport(node) if node.get("network") != "tcp" else None
+                "transport": self._get_transport(node) if node.network != "tcp" else None
             }
         
         elif protocol == "ss":
-            method_pass = node.get("uuid_or_password", "").split(":", 1)
+            method_pass = node.uuid_or_password.split(":", 1)
             return {
                 "type": "shadowsocks",
                 "tag": tag,
-                "server": node.get("address"),
-                "server_port": node.get("port"),
+                "server": node.address,
+                "server_port": node.port,
                 "method": method_pass[0] if method_pass else "aes-256-gcm",
                 "password": method_pass[1] if len(method_pass) > 1 else ""
             }
         
         return None
     
-    def _get_transport(self, node: dict) -> Optional[dict]:
+    def _get_transport(self, node: ProxyNode) -> Optional[dict]:
         """獲取傳輸層配置"""
-        network = node.get("network", "tcp")
+        network = node.network
         
         if network == "ws":
             return {
                 "type": "ws",
-                "path": node.get("path", "/"),
-                "headers": {"Host": node.get("host", "")} if node.get("host") else None
+                "path": node.path,
+                "headers": {"Host": node.host} if node.host else None
             }
         elif network == "grpc":
             return {
                 "type": "grpc",
-                "service_name": node.get("path", "")
+                "service_name": node.path
             }
         
         return None
     
-    def _get_tls(self, node: dict) -> dict:
+    def _get_tls(self, node: ProxyNode) -> dict:
         """獲取 TLS 配置"""
         return {
             "enabled": True,
-            "server_name": node.get("sni") or node.get("host") or node.get("address"),
+            "server_name": node.sni or node.host or node.address,
             "insecure": True
         }
     
-    def node_to_clash_proxy(self, node: dict) -> Optional[dict]:
+    def node_to_clash_proxy(self, node: ProxyNode) -> Optional[dict]:
         """將節點轉換為 Clash proxy"""
-        protocol = node.get("protocol", "")
-        name = node.get("name") or f"{node.get('address')}:{node.get('port')}"
+        protocol = node.protocol
+        name = node.name or f"{node.address}:{node.port}"
         
         if protocol == "vmess":
             proxy = {
                 "name": name,
                 "type": "vmess",
-                "server": node.get("address"),
-                "port": node.get("port"),
-                "uuid": node.get("uuid_or_password"),
+                "server": node.address,
+                "port": node.port,
+                "uuid": node.uuid_or_password,
                 "alterId": 0,
                 "cipher": "auto",
             }
             
-            network = node.get("network", "tcp")
+            network = node.network
             if network == "ws":
                 proxy["network"] = "ws"
                 proxy["ws-opts"] = {
-                    "path": node.get("path", "/"),
-                    "headers": {"Host": node.get("host", "")} if node.get("host") else {}
+                    "path": node.path,
+                    "headers": {"Host": node.host} if node.host else {}
                 }
             
-            if node.get("tls"):
+            if node.tls:
                 proxy["tls"] = True
-                proxy["servername"] = node.get("sni") or node.get("host") or ""
+                proxy["servername"] = node.sni or node.host or ""
                 proxy["skip-cert-verify"] = True
             
             return proxy
@@ -181,22 +185,22 @@ class SubscriptionMerger:
             proxy = {
                 "name": name,
                 "type": "vless",
-                "server": node.get("address"),
-                "port": node.get("port"),
-                "uuid": node.get("uuid_or_password"),
+                "server": node.address,
+                "port": node.port,
+                "uuid": node.uuid_or_password,
             }
             
-            network = node.get("network", "tcp")
+            network = node.network
             if network == "ws":
                 proxy["network"] = "ws"
                 proxy["ws-opts"] = {
-                    "path": node.get("path", "/"),
-                    "headers": {"Host": node.get("host", "")} if node.get("host") else {}
+                    "path": node.path,
+                    "headers": {"Host": node.host} if node.host else {}
                 }
             
-            if node.get("tls"):
+            if node.tls:
                 proxy["tls"] = True
-                proxy["servername"] = node.get("sni") or ""
+                proxy["servername"] = node.sni or ""
                 proxy["skip-cert-verify"] = True
             
             return proxy
@@ -205,94 +209,94 @@ class SubscriptionMerger:
             return {
                 "name": name,
                 "type": "trojan",
-                "server": node.get("address"),
-                "port": node.get("port"),
-                "password": node.get("uuid_or_password"),
-                "sni": node.get("sni") or "",
+                "server": node.address,
+                "port": node.port,
+                "password": node.uuid_or_password,
+                "sni": node.sni or "",
                 "skip-cert-verify": True
             }
         
         elif protocol == "ss":
-            method_pass = node.get("uuid_or_password", "").split(":", 1)
+            method_pass = node.uuid_or_password.split(":", 1)
             return {
                 "name": name,
                 "type": "ss",
-                "server": node.get("address"),
-                "port": node.get("port"),
+                "server": node.address,
+                "port": node.port,
                 "cipher": method_pass[0] if method_pass else "aes-256-gcm",
                 "password": method_pass[1] if len(method_pass) > 1 else ""
             }
         
         return None
     
-    def node_to_uri(self, node: dict) -> Optional[str]:
+    def node_to_uri(self, node: ProxyNode) -> Optional[str]:
         """將節點轉換為 URI"""
-        protocol = node.get("protocol", "")
+        protocol = node.protocol
         
         if protocol == "vmess":
             config = {
                 "v": "2",
-                "ps": node.get("name", ""),
-                "add": node.get("address"),
-                "port": str(node.get("port")),
-                "id": node.get("uuid_or_password"),
+                "ps": node.name,
+                "add": node.address,
+                "port": str(node.port),
+                "id": node.uuid_or_password,
                 "aid": "0",
-                "net": node.get("network", "tcp"),
+                "net": node.network,
                 "type": "none",
-                "host": node.get("host", ""),
-                "path": node.get("path", ""),
-                "tls": "tls" if node.get("tls") else "",
-                "sni": node.get("sni", "")
+                "host": node.host,
+                "path": node.path,
+                "tls": "tls" if node.tls else "",
+                "sni": node.sni
             }
             encoded = base64.b64encode(json.dumps(config).encode()).decode()
             return f"vmess://{encoded}"
         
         elif protocol == "vless":
             params = []
-            if node.get("network") and node["network"] != "tcp":
-                params.append(f"type={node['network']}")
-            if node.get("tls"):
+            if node.network and node.network != "tcp":
+                params.append(f"type={node.network}")
+            if node.tls:
                 params.append("security=tls")
-            if node.get("sni"):
-                params.append(f"sni={node['sni']}")
-            if node.get("path"):
-                params.append(f"path={quote(node['path'])}")
-            if node.get("host"):
-                params.append(f"host={node['host']}")
+            if node.sni:
+                params.append(f"sni={node.sni}")
+            if node.path:
+                params.append(f"path={quote(node.path)}")
+            if node.host:
+                params.append(f"host={node.host}")
             
             param_str = "&".join(params) if params else ""
-            name = quote(node.get("name", ""))
+            name = quote(node.name)
             
-            return f"vless://{node['uuid_or_password']}@{node['address']}:{node['port']}?{param_str}#{name}"
+            return f"vless://{node.uuid_or_password}@{node.address}:{node.port}?{param_str}#{name}"
         
         elif protocol == "trojan":
             params = []
-            if node.get("sni"):
-                params.append(f"sni={node['sni']}")
+            if node.sni:
+                params.append(f"sni={node.sni}")
             
             param_str = "&".join(params) if params else ""
-            name = quote(node.get("name", ""))
+            name = quote(node.name)
             
-            return f"trojan://{node['uuid_or_password']}@{node['address']}:{node['port']}?{param_str}#{name}"
+            return f"trojan://{node.uuid_or_password}@{node.address}:{node.port}?{param_str}#{name}"
         
         elif protocol == "ss":
-            method_pass = node.get("uuid_or_password", "")
+            method_pass = node.uuid_or_password
             encoded = base64.b64encode(method_pass.encode()).decode()
-            name = quote(node.get("name", ""))
+            name = quote(node.name)
             
-            return f"ss://{encoded}@{node['address']}:{node['port']}#{name}"
+            return f"ss://{encoded}@{node.address}:{node.port}#{name}"
         
         return None
     
-    def generate_singbox_config(self, nodes: list[dict]) -> dict:
+    def generate_singbox_config(self, nodes: list[ProxyNode]) -> dict:
         """生成 sing-box 配置"""
         outbounds = []
         proxy_tags = []
         
         for i, node in enumerate(nodes[:self.max_nodes]):
-            source = node.get("source", "aggregated")
+            source = node.source
             prefix = "⭐" if source == "bpb" else "🌐"
-            node_name = node.get('name') or "{}:{}".format(node.get("address"), node.get("port"))
+            node_name = node.name or "{}:{}".format(node.address, node.port)
             tag = "{} {}".format(prefix, node_name)[:50]
             tag = "{}-{}".format(tag, i)  # 確保唯一
             
@@ -364,7 +368,7 @@ class SubscriptionMerger:
         
         return config
     
-    def generate_clash_config(self, nodes: list[dict]) -> dict:
+    def generate_clash_config(self, nodes: list[ProxyNode]) -> dict:
         """生成 Clash 配置"""
         proxies = []
         proxy_names = []
@@ -413,7 +417,7 @@ class SubscriptionMerger:
         
         return config
     
-    def generate_base64(self, nodes: list[dict]) -> str:
+    def generate_base64(self, nodes: list[ProxyNode]) -> str:
         """生成 Base64 訂閱"""
         uris = []
         
@@ -425,38 +429,52 @@ class SubscriptionMerger:
         content = "\n".join(uris)
         return base64.b64encode(content.encode()).decode()
     
+    def _load_candidates(self, use_tested: bool = True) -> Iterator[tuple[ProxyNode, Optional[TestResult]]]:
+        """惰性載入測試通過的節點；沒有測試結果時退回原始節點"""
+        if use_tested and Path(TESTED_NODES_PATH).exists():
+            for item in iter_records(TESTED_NODES_PATH):
+                node = ProxyNode.from_dict(item)
+                yield node, TestResult.from_dict(node.unique_id, item.get("test_result", {}))
+            return
+        
+        if use_tested:
+            print("⚠ 未找到測試後的節點，使用原始節點")
+        if Path(RAW_NODES_PATH).exists():
+            for item in iter_records(RAW_NODES_PATH):
+                yield ProxyNode.from_dict(item), None
+    
     async def merge_and_generate(self):
         """合併並生成所有格式"""
         print("🦐 開始合併訂閱...\n")
         
-        # 載入測試通過的節點
-        nodes = []
-        try:
-            with open("output/tested_nodes.json", 'r') as f:
-                data = json.load(f)
-                nodes = data.get("nodes", [])
-        except FileNotFoundError:
-            print("⚠ 未找到測試後的節點，使用原始節點")
-            try:
-                with open("output/raw_nodes.json", 'r') as f:
-                    data = json.load(f)
-                    nodes = data.get("nodes", [])
-            except:
-                pass
+        # IP 情報提供者全部故障時所有節點都被排除；保留上次的訂閱，沒有時退回原始節點
+        summary = read_summary(TESTED_NODES_PATH) or {}
+        use_tested = not summary.get("intel_outage")
+        if not use_tested:
+            if (Path("output") / "index.json").exists():
+                print("⚠ 本次 IP 情報查詢全部失敗，保留上次生成的訂閱")
+                return
+            print("⚠ 本次 IP 情報查詢全部失敗，使用原始節點")
         
         # 獲取 BPB Panel 訂閱
         bpb_nodes = await self.fetch_bpb_subscription()
         
-        # 合併節點（BPB 優先）
-        all_nodes = bpb_nodes + nodes
-        
         # 按優先級和延遲排序
-        all_nodes.sort(key=lambda x: (
-            x.get("priority", 99),
-            x.get("test_result", {}).get("latency_ms", 9999)
-        ))
-        
-        print(f"\n合併後共 {len(all_nodes)} 個節點")
+        def rank(item: tuple[ProxyNode, Optional[TestResult]]):
+            node, result = item
+            if result is None:
+                return (node.priority, 9999)
+            if self.rank_latency == "tls":
+                return (node.priority, result.tls_complete_ms)
+            return (node.priority, result.latency_ms)
+        
+        # 測試節點只保留前 max_nodes 個 (有界堆，不需完整排序)，再與 BPB 節點合併（BPB 優先）
+        bpb_run = sorted(((node, None) for node in bpb_nodes), key=rank)
+        best = top_k(self._load_candidates(use_tested), self.max_nodes, key=rank)
+        merged = merge_sorted(bpb_run, best, key=rank, limit=self.max_nodes)
+        all_nodes = [node for node, _ in merged]
+        
+        print(f"\n合併後共 {len(all_nodes)} 個節點 (上限 {self.max_nodes})")
         
         # 生成各種格式
         output_dir = Path("output")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+IP 過濾政策 - 啟動時把 ip_purity 設定編譯成集合與排序後的 CIDR 範圍
+
+check_address 只看 IP 本身 (DNS 解析後立即可用)，
+check_info 需要 IP 情報 (ASN / 國家 / 數據中心 / VPN / 信任分數)。
+"""
+
+import json
+import bisect
+import hashlib
+import ipaddress
+from typing import Iterable, Optional
+
+
+class CIDRSet:
+    """CIDR 集合：合併重疊範圍後以二分搜尋判斷 IP 是否在其中"""
+
+    def __init__(self, cidrs: Iterable[str]):
+        ranges: dict[int, list[tuple[int, int]]] = {4: [], 6: []}
+        for cidr in cidrs:
+            try:
+                net = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                print(f"⚠ 忽略無效的 CIDR: {cidr}")
+                continue
+            ranges[net.version].append((int(net.network_address), int(net.broadcast_address)))
+
+        self._starts: dict[int, list[int]] = {}
+        self._ends: dict[int, list[int]] = {}
+        for version, items in ranges.items():
+            merged: list[list[int]] = []
+            for start, end in sorted(items):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __len__(self) -> int:
+        return sum(len(starts) for starts in self._starts.values())
+
+    def __contains__(self, ip: str) -> bool:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        starts = self._starts[addr.version]
+        value = int(addr)
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= self._ends[addr.version][index]
+
+
+class IPPolicy:
+    """編譯後的 IP 過濾政策"""
+
+    def __init__(self, blocked_asns: Iterable = (), blocked_countries: Iterable[str] = (),
+                 blocked_cidrs: Iterable[str] = (), block_datacenter: bool = False,
+                 block_vpn: bool = False, min_trust_score: int = 30):
+        self.blocked_asns = {int(str(asn).upper().replace("AS", "")) for asn in blocked_asns}
+        self.blocked_countries = {code.upper() for code in blocked_countries}
+        blocked_cidrs = sorted(str(cidr) for cidr in blocked_cidrs)
+        self.blocked_cidrs = CIDRSet(blocked_cidrs)
+        self.block_datacenter = block_datacenter
+        self.block_vpn = block_vpn
+        self.min_trust_score = min_trust_score
+        # 政策內容的指紋：沿用歷史結果前比對，政策變更後舊結果不再沿用
+        canonical = json.dumps([
+            sorted(self.blocked_asns), sorted(self.blocked_countries),
+            blocked_cidrs, block_datacenter, block_vpn, min_trust_score
+        ])
+        self.fingerprint = hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "IPPolicy":
+        """從 settings.json 的 ip_purity 區段建立"""
+        return cls(
+            blocked_asns=config.get("blocked_asns", []),
+            blocked_countries=config.get("blocked_countries", []),
+            blocked_cidrs=config.get("blocked_cidrs", []),
+            block_datacenter=config.get("block_datacenter", False),
+            block_vpn=config.get("block_vpn_detected", False),
+            min_trust_score=config.get("min_trust_score", 30)
+        )
+
+    def check_address(self, ip: str) -> Optional[str]:
+        """只依 IP 判斷，返回封鎖原因；允許時為 None"""
+        if self.blocked_cidrs and ip in self.blocked_cidrs:
+            return "cidr"
+        return None
+
+    def check_info(self, info: dict) -> Optional[str]:
+        """依 IP 情報判斷，返回封鎖原因；允許時為 None"""
+        if info.get("asn") in self.blocked_asns:
+            return f"asn AS{info['asn']}"
+        if info.get("country") and info["country"] in self.blocked_countries:
+            return f"country {info['country']}"
+        if self.block_datacenter and info.get("is_datacenter"):
+            return "datacenter"
+        if self.block_vpn and info.get("is_vpn"):
+            return "vpn"
+        if info.get("trust_score", 100) < self.min_trust_score:
+            return f"trust score {info['trust_score']}"
+        return None
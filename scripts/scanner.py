@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+批量 TCP 連線掃描 - 大量節點的第一輪可達性篩選
+
+直接以非阻塞 socket + loop.sock_connect 連線，不建立 StreamReader/StreamWriter；
+設定 SO_LINGER 0，關閉時送出 RST 而非 FIN，不會留下大量 TIME_WAIT。
+"""
+
+import time
+import socket
+import struct
+import asyncio
+from typing import Iterable, Optional
+
+from concurrency import FD_RESERVE, fd_limit
+
+# l_onoff = 1, l_linger = 0: close() 時直接送 RST
+LINGER_RST = struct.pack("ii", 1, 0)
+
+
+class ConnectScanner:
+    """以固定數量的 worker 對一批 (ip, port) 發起連線，記錄連線延遲"""
+
+    def __init__(self, timeout: float = 3, concurrency: int = 2000):
+        limit = fd_limit()
+        if limit is not None:
+            concurrency = min(concurrency, max(1, limit - FD_RESERVE))
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+
+    async def connect(self, ip: str, port: int) -> Optional[int]:
+        """連線一次，成功返回延遲 ms，失敗返回 None"""
+        loop = asyncio.get_running_loop()
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError:
+            return None
+        try:
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RST)
+            start = time.perf_counter()
+            await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout=self.timeout)
+            return int((time.perf_counter() - start) * 1000)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            sock.close()
+
+    async def scan(self, targets: Iterable[tuple[str, int]]) -> dict[tuple[str, int], Optional[int]]:
+        """掃描去重後的目標，返回 {(ip, port): 延遲 ms 或 None}"""
+        pending = list(dict.fromkeys(targets))
+        results: dict[tuple[str, int], Optional[int]] = {}
+        iterator = iter(pending)
+
+        async def worker():
+            for target in iterator:
+                results[target] = await self.connect(*target)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending)))))
+        return results
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+節點篩選 - 只需要前 K 個時避免完整排序
+"""
+
+import heapq
+from itertools import islice
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+def top_k(items: Iterable[T], k: int, key: Callable[[T], object]) -> list[T]:
+    """以有界堆取出 key 最小的 k 個，結果等同 sorted(items, key=key)[:k] (穩定)
+
+    輸入可以是惰性迭代器，記憶體只與 k 成正比。
+    """
+    if k <= 0:
+        return []
+    return heapq.nsmallest(k, items, key=key)
+
+
+def merge_sorted(*runs: Iterable[T], key: Callable[[T], object], limit: int = -1) -> list[T]:
+    """合併多個已排序的序列，鍵相同時前面的序列優先；limit >= 0 時只取前 limit 個"""
+    merged: Iterator[T] = heapq.merge(*runs, key=key)
+    if limit >= 0:
+        merged = islice(merged, limit)
+    return list(merged)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+請求合併 (singleflight) - 相同 key 的並發呼叫只執行一次，其他呼叫者等待同一結果
+
+只合併進行中的呼叫，完成後即移除；結果的快取由呼叫者負責
+(先查快取，未命中時再經過 SingleFlight)。
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """進行中呼叫的合併器"""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.executed = 0   # 實際執行次數
+        self.coalesced = 0  # 共用進行中結果的次數
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        value, _ = await self.execute(key, factory)
+        return value
+
+    async def execute(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """同 do，另外返回本次呼叫是否實際執行了 factory (False 表示共用了進行中的結果)"""
+        future = self._calls.get(key)
+        leader = future is None
+        if leader:
+            self.executed += 1
+            future = asyncio.ensure_future(factory())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        # shield: 某個呼叫者被取消時不影響其他等待同一結果的呼叫者
+        return await asyncio.shield(future), leader
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -4,38 +4,132 @@
 """
 
 import json
+import errno
 import asyncio
-import aiohttp
-import socket
 import ssl
 import time
-from pathlib import Path
+import statistics
+from collections import Counter, OrderedDict
 from dataclasses import dataclass
-from typing import Optional
-import ipaddress
+from typing import Iterable, Optional, Sequence
 
+from aggregate import ProxyNode
+from dns_cache import DNSCache, HostResolver
+from dns_resolver import AsyncResolver
+from concurrency import AdaptiveLimiter
+from history import REUSE, SKIP, TEST, TestHistory
+from ip_intel import IPIntelCache, IPIntelClient, build_providers
+from policy import IPPolicy
+from scanner import ConnectScanner
+from singleflight import SingleFlight
+from artifacts import NDJSONWriter, RAW_NODES_PATH, TESTED_NODES_PATH, iter_records
 
-@dataclass
+
+@dataclass(slots=True)
 class TestResult:
     """測試結果"""
     node_id: str
     tcp_ok: bool = False
     tls_ok: bool = False
-    latency_ms: int = 9999
-    ip_info: dict = None
+    latency_ms: int = 9999  # TCP 連線延遲 (多次取樣的中位數)
+    tls_ms: int = 9999      # TLS 握手延遲 (不含 TCP 連線；非 TLS 節點為 0)
+    dns_ms: int = 0         # DNS 解析耗時 (快取命中或與其他節點共用查詢時為 0)
+    ip_lookup_ms: int = 0   # IP 資訊查詢耗時
+    latency_min_ms: int = 9999
+    latency_p90_ms: int = 9999
+    jitter_ms: int = 0
+    loss_rate: float = 1.0
+    samples: int = 0
+    ip_country: str = ""
     ip_score: int = 0  # 0-100, 越高越好
     china_friendly: bool = False
     error: str = ""
+    blocked: bool = False  # 被過濾政策排除 (不寫入歷史)
+    prescanned: bool = False  # 預掃描判定不可達 (未實際探測)
+    measured: bool = False  # 本節點實際發出了探測 (非共用其他節點的結果)，只有這些結果回報給並發限制器
+    
+    @property
+    def tls_complete_ms(self) -> int:
+        """從開始連線到 TLS 握手完成的時間 (可實際傳輸資料的時間點)"""
+        return self.latency_ms + self.tls_ms
+    
+    def to_dict(self) -> dict:
+        """轉換為保存格式 (節點的 test_result 欄位)"""
+        return {
+            "tcp_ok": self.tcp_ok,
+            "tls_ok": self.tls_ok,
+            "latency_ms": self.latency_ms,
+            "tls_ms": self.tls_ms,
+            "dns_ms": self.dns_ms,
+            "ip_lookup_ms": self.ip_lookup_ms,
+            "latency_min_ms": self.latency_min_ms,
+            "latency_p90_ms": self.latency_p90_ms,
+            "jitter_ms": self.jitter_ms,
+            "loss_rate": self.loss_rate,
+            "samples": self.samples,
+            "ip_score": self.ip_score,
+            "china_friendly": self.china_friendly,
+            "ip_country": self.ip_country,
+            "error": self.error
+        }
+    
+    @classmethod
+    def from_dict(cls, node_id: str, data: dict) -> "TestResult":
+        """從保存格式還原"""
+        return cls(
+            node_id=node_id,
+            tcp_ok=data.get("tcp_ok", False),
+            tls_ok=data.get("tls_ok", False),
+            latency_ms=data.get("latency_ms", 9999),
+            tls_ms=data.get("tls_ms", 9999),
+            dns_ms=data.get("dns_ms", 0),
+            ip_lookup_ms=data.get("ip_lookup_ms", 0),
+            latency_min_ms=data.get("latency_min_ms", 9999),
+            latency_p90_ms=data.get("latency_p90_ms", 9999),
+            jitter_ms=data.get("jitter_ms", 0),
+            loss_rate=data.get("loss_rate", 1.0),
+            samples=data.get("samples", 0),
+            ip_country=data.get("ip_country", ""),
+            ip_score=data.get("ip_score", 0),
+            china_friendly=data.get("china_friendly", False),
+            error=data.get("error", "")
+        )
+
+
+@dataclass(slots=True)
+class ProbeResult:
+    """單一網路目標 (ip, port, sni) 的連線測試結果；多次取樣時延遲為中位數"""
+    tcp_ok: bool = False
+    tcp_ms: int = 9999
+    tls_ok: bool = False
+    tls_ms: int = 9999
+    min_ms: int = 9999
+    p90_ms: int = 9999
+    jitter_ms: int = 0
+    loss_rate: float = 1.0
+    samples: int = 0
+    refused: bool = False  # 連線被拒或路由不可達 (重試也不會成功，不同於可能只是掉包的逾時)
+
+
+# 視為明確失敗的連線錯誤
+UNREACHABLE_ERRNOS = {errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH}
+
+
+def latency_stats(values: list[int]) -> tuple[int, int, int, int]:
+    """返回 (最小值, 中位數, p90, 抖動)；抖動為相鄰樣本差的平均絕對值"""
+    ordered = sorted(values)
+    p90 = statistics.quantiles(ordered, n=10, method="inclusive")[-1] if len(ordered) > 1 else ordered[0]
+    jitter = statistics.fmean(abs(b - a) for a, b in zip(values, values[1:])) if len(values) > 1 else 0
+    return ordered[0], int(statistics.median(ordered)), int(p90), int(jitter)
+
+
+# 測試通過的節點與其結果
+TestedNode = tuple[ProxyNode, TestResult]
 
 
 class IPChecker:
     """IP 純淨度檢測"""
     
-    # 已知被封鎖/不乾淨的 ASN
-    BLOCKED_ASNS = {
-        # 可根據經驗添加
-    }
-    
     # 已知乾淨的 CDN/雲端 ASN
     TRUSTED_ASNS = {
         13335,   # Cloudflare
@@ -45,14 +139,48 @@ class IPChecker:
         8075,    # Microsoft
     }
     
-    def __init__(self):
+    def __init__(self, client: Optional[IPIntelClient] = None, store: Optional[IPIntelCache] = None):
+        # 查詢合併成批次送出，並依提供者回報的額度限速
+        self.client = client or IPIntelClient()
+        # 跨次執行的快取；self.cache 只保存本次執行算好的結果
+        self.store = store
         self.cache = {}
+        self.stats: Counter = Counter()
+        # 同一 IP 的並發檢查只查詢一次 (self.cache 在 await 之後才寫入)
+        self.flight = SingleFlight()
+        self._refreshing: set[asyncio.Task] = set()
     
-    async def check_ip(self, session: aiohttp.ClientSession, ip: str) -> dict:
+    def trust_score(self, info: dict) -> int:
+        """計算信任分數"""
+        score = 50
+        
+        # 數據中心 IP 減分
+        if info["is_datacenter"]:
+            score -= 20
+        
+        # 可信 ASN 加分
+        if info["asn"] in self.TRUSTED_ASNS:
+            score += 30
+        
+        # 中國 IP 不適合 (用於翻牆)
+        if info["country"] == "CN":
+            score -= 40
+        
+        return max(0, min(100, score))
+    
+    @property
+    def all_failed(self) -> bool:
+        """本次執行的所有檢查都拿不到情報 (提供者故障)"""
+        checks = sum(self.stats[key] for key in ("cached", "inferred", "stale", "lookup"))
+        return self.stats["failed"] > 0 and self.stats["failed"] == checks
+    
+    async def check_ip(self, ip: str) -> dict:
         """檢查 IP 資訊"""
         if ip in self.cache:
             return self.cache[ip]
-        
+        return await self.flight.do(ip, lambda: self._check(ip))
+    
+    async def _check(self, ip: str) -> dict:
         info = {
             "ip": ip,
             "country": "",
@@ -63,58 +191,54 @@ class IPChecker:
             "trust_score": 50
         }
         
-        try:
-            # 使用 ip-api.com (免費，有速率限制)
-            async with session.get(
-                f"http://ip-api.com/json/{ip}?fields=status,country,countryCode,isp,org,as,hosting",
-                timeout=aiohttp.ClientTimeout(total=5)
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    if data.get("status") == "success":
-                        info["country"] = data.get("countryCode", "")
-                        info["org"] = data.get("org", "")
-                        info["is_datacenter"] = data.get("hosting", False)
-                        
-                        # 提取 ASN
-                        as_str = data.get("as", "")
-                        if as_str:
-                            try:
-                                info["asn"] = int(as_str.split()[0].replace("AS", ""))
-                            except:
-                                pass
-                        
-                        # 計算信任分數
-                        score = 50
-                        
-                        # 數據中心 IP 減分
-                        if info["is_datacenter"]:
-                            score -= 20
-                        
-                        # 可信 ASN 加分
-                        if info["asn"] in self.TRUSTED_ASNS:
-                            score += 30
-                        
-                        # 被封鎖 ASN 減分
-                        if info["asn"] in self.BLOCKED_ASNS:
-                            score -= 50
-                        
-                        # 中國 IP 不適合 (用於翻牆)
-                        if info["country"] == "CN":
-                            score -= 40
-                        
-                        info["trust_score"] = max(0, min(100, score))
+        data, stale = self.store.get(ip) if self.store else (None, False)
+        if data is None:
+            self.stats["lookup"] += 1
+            data = await self.client.lookup(ip)
+            # VPN 未知 (線上提供者都查不到) 的結果不保存，下次執行重新查詢
+            if self.store and "error" not in data and data.get("is_vpn") is not None:
+                self.store.put(ip, data)
+        elif stale:
+            # 先用舊結果，背景重新查詢
+            self.stats["stale"] += 1
+            task = asyncio.create_task(self._refresh(ip))
+            self._refreshing.add(task)
+            task.add_done_callback(self._refreshing.discard)
+        else:
+            self.stats["inferred" if data.get("inferred") else "cached"] += 1
         
-        except Exception as e:
-            info["error"] = str(e)
+        if "error" in data:
+            # 查不到情報時不給中性分數，否則提供者全部故障時信任門檻形同失效
+            self.stats["failed"] += 1
+            info["error"] = data["error"]
+            info["trust_score"] = 0
+        else:
+            info.update(data)
+            info["trust_score"] = self.trust_score(info)
         
         self.cache[ip] = info
         return info
+    
+    async def _refresh(self, ip: str):
+        data = await self.client.lookup(ip)
+        if "error" not in data and data.get("is_vpn") is not None:
+            self.store.put(ip, data)
+    
+    async def close(self):
+        # 先關閉客戶端：逾時未完成的查詢會被取消，等待中的背景更新隨之結束 (舊結果仍在快取中)
+        await self.client.close()
+        if self._refreshing:
+            await asyncio.gather(*self._refreshing, return_exceptions=True)
+        if self.store:
+            self.store.save()
 
 
 class NodeTester:
     """節點測試器"""
     
+    # 保留的已完成探測結果數量 (同一目標之後再出現時直接沿用)
+    PROBE_CACHE_SIZE = 10000
+    
     def __init__(self, settings_path: str = "config/settings.json"):
         with open(settings_path, 'r') as f:
             self.settings = json.load(f)
@@ -122,198 +246,534 @@ class NodeTester:
         self.test_config = self.settings.get("testing", {})
         self.timeout = self.test_config.get("timeout_seconds", 10)
         self.max_concurrent = self.test_config.get("max_concurrent", 50)
+        self.queue_size = self.test_config.get("queue_size", 1000)
+        # 每個目標的取樣次數 (預設為 retry_count + 1) 與取樣間隔
+        self.samples = max(1, self.test_config.get("samples", self.test_config.get("retry_count", 0) + 1))
+        self.sample_interval = self.test_config.get("sample_interval_ms", 200) / 1000
+        self.concurrency_config = self.test_config.get("concurrency", {})
         
-        self.ip_checker = IPChecker()
+        # 測試歷史：最近且穩定的節點不重新探測
+        history_config = self.test_config.get("history", {})
+        self.history: Optional[TestHistory] = None
+        if history_config.get("enabled", True):
+            self.history = TestHistory(
+                history_config.get("path", "cache/history.sqlite3"),
+                recheck_hours=history_config.get("recheck_hours", 36),
+                stable_streak=history_config.get("stable_streak", 3),
+                max_backoff_hours=history_config.get("max_backoff_hours", 168)
+            )
+        self.history_stats: Counter = Counter()
+        
+        purity_config = self.test_config.get("ip_purity", {})
+        # blocked_asns / blocked_countries / blocked_cidrs 等設定在啟動時編譯一次
+        self.policy = IPPolicy.from_config(purity_config)
+        self.block_stats: Counter = Counter()
+        providers = build_providers(purity_config.get("providers", [{"name": "ip-api"}]))
+        cache_config = purity_config.get("cache", {})
+        ip_store = None
+        if cache_config.get("enabled", True):
+            ip_store = IPIntelCache(
+                cache_config.get("path", "cache/ip_intel.json"),
+                ttl_hours=cache_config.get("ttl_hours", 168),
+                stale_hours=cache_config.get("stale_hours", 720),
+                # 網段推斷不含 is_vpn；封鎖 VPN 時每個 IP 都要查到自己的 VPN 判斷，不做推斷
+                infer_prefix=cache_config.get("infer_prefix", True) and not self.policy.block_vpn
+            )
+        self.ip_checker = IPChecker(IPIntelClient(
+            providers, batch_delay=purity_config.get("batch_delay_ms", 50) / 1000,
+            vpn_filter=self._needs_vpn_check
+        ), ip_store)
         self.results: dict[str, TestResult] = {}
+        
+        # TLS 測試只驗證握手能否完成，不驗證憑證
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+        
+        # 探測去重：相同網路目標只探測一次，結果分給所有共用的節點
+        # 進行中的探測由 SingleFlight 合併，完成的結果只保留最近 PROBE_CACHE_SIZE 個目標
+        self.probe_flight = SingleFlight()
+        self._probe_results: OrderedDict[tuple[str, int, str], ProbeResult] = OrderedDict()
+        
+        # 預掃描：節點數量大時先以輕量 TCP 連線篩掉不可達的目標
+        scan_config = self.test_config.get("prescan", {})
+        self.scanner: Optional[ConnectScanner] = None
+        self.scan_min_nodes = scan_config.get("min_nodes", 2000)
+        if scan_config.get("enabled", True):
+            self.scanner = ConnectScanner(
+                timeout=scan_config.get("timeout_seconds", 3),
+                concurrency=scan_config.get("concurrency", 2000)
+            )
+        self._unreachable: set[tuple[str, int]] = set()
+        
+        dns_config = self.test_config.get("dns", {})
+        dns_cache = None
+        if dns_config.get("cache_enabled", True):
+            dns_cache = DNSCache(
+                dns_config.get("cache_path", "cache/dns.json"),
+                negative_ttl=dns_config.get("negative_ttl", 300)
+            )
+        engine = None
+        if dns_config.get("engine", "native") == "native":
+            engine = AsyncResolver(
+                dns_config.get("resolvers") or None,
+                transport=dns_config.get("transport", "udp"),
+                timeout=dns_config.get("query_timeout", 2),
+                retries=dns_config.get("retries", 2),
+                doh_url=dns_config.get("doh_url", "https://cloudflare-dns.com/dns-query"),
+                tls_server_name=dns_config.get("tls_server_name", "")
+            )
+        self.resolver = HostResolver(
+            dns_cache,
+            concurrency=dns_config.get("concurrency", 100),
+            timeout=self.timeout,
+            default_ttl=dns_config.get("default_ttl", 3600),
+            engine=engine
+        )
+    
+    def _needs_vpn_check(self, info: dict) -> bool:
+        """離線情報的 VPN 未知時，只有封鎖 VPN 且其他條件都通過的 IP 才交給線上提供者"""
+        if not self.policy.block_vpn or info.get("country") == "CN":
+            return False
+        scored = dict(info, trust_score=self.ip_checker.trust_score(info))
+        return self.policy.check_info(scored) is None
     
     async def resolve_host(self, host: str) -> Optional[str]:
-        """解析主機名到 IP"""
-        try:
-            # 如果已經是 IP，直接返回
-            ipaddress.ip_address(host)
-            return host
-        except ValueError:
-            pass
-        
-        try:
-            loop = asyncio.get_event_loop()
-            result = await loop.getaddrinfo(host, None, family=socket.AF_INET)
-            if result:
-                return result[0][4][0]
-        except Exception:
-            pass
+        """解析主機名到 IP (所有記錄保存在快取中，這裡返回首選位址)"""
+        addrs = await self.resolver.resolve(host)
+        return addrs[0] if addrs else None
+    
+    async def warm_dns(self, nodes: list[ProxyNode]):
+        """解析階段：探測前先去重主機名並並行解析，讓後續查詢直接命中快取"""
+        hosts = {node.address for node in nodes}
+        resolved = await self.resolver.resolve_many(hosts)
+        failed = sum(1 for addrs in resolved.values() if not addrs)
+        print(f"🌐 DNS: {len(resolved)} 個主機名 ({failed} 個解析失敗)")
+    
+    async def prescan(self, nodes: list[ProxyNode]):
+        """第一輪篩選：對需要探測的節點目標做一次 TCP 連線，不可達的目標不再進入完整探測"""
+        candidates = []
+        for node in nodes:
+            if not node.address or not node.port:
+                continue
+            if self.history and self.history.plan(node.unique_id)[0] != TEST:
+                continue
+            candidates.append(node)
+        resolved = await self.resolver.resolve_many(node.address for node in candidates)
+        targets = set()
+        for node in candidates:
+            addrs = resolved.get(node.address)
+            if addrs and not self.policy.check_address(addrs[0]):
+                targets.add((addrs[0], node.port))
         
-        return None
+        start = time.perf_counter()
+        results = await self.scanner.scan(targets)
+        unreachable = [target for target, latency in results.items() if latency is None]
+        # 單次 SYN 逾時可能只是丟包，不可達的目標再掃一次才排除
+        retried = await self.scanner.scan(unreachable)
+        self._unreachable = {target for target, latency in retried.items() if latency is None}
+        print(f"📡 預掃描: {len(results)} 個目標, {len(self._unreachable)} 個不可達 "
+              f"({time.perf_counter() - start:.1f}s, 並發 {self.scanner.concurrency})")
     
-    async def test_tcp(self, host: str, port: int) -> tuple[bool, int]:
-        """TCP 連接測試，返回 (成功, 延遲ms)"""
+    async def test_connection(self, ip: str, port: int, sni: str = "") -> ProbeResult:
+        """單一連線完成 TCP 與 TLS 測試：連線後以 start_tls 原地升級，不再重新連線"""
+        probe = ProbeResult()
+        loop = asyncio.get_running_loop()
+        transport = None
+        
         try:
-            start = time.time()
-            
-            # 創建連接
-            loop = asyncio.get_event_loop()
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(host, port),
+            start = time.perf_counter()
+            transport, protocol = await asyncio.wait_for(
+                loop.create_connection(asyncio.Protocol, ip, port),
                 timeout=self.timeout
             )
+            probe.tcp_ok = True
+            probe.tcp_ms = int((time.perf_counter() - start) * 1000)
             
-            latency = int((time.time() - start) * 1000)
-            writer.close()
-            await writer.wait_closed()
-            
-            return True, latency
-            
+            if sni:
+                start = time.perf_counter()
+                transport = await asyncio.wait_for(
+                    loop.start_tls(transport, protocol, self.ssl_context, server_hostname=sni),
+                    timeout=self.timeout
+                )
+                probe.tls_ok = True
+                probe.tls_ms = int((time.perf_counter() - start) * 1000)
+        
+        except OSError as e:
+            probe.refused = not probe.tcp_ok and e.errno in UNREACHABLE_ERRNOS
         except Exception:
-            return False, 9999
+            pass
+        finally:
+            if transport is not None:
+                transport.close()
+        
+        return probe
     
-    async def test_tls(self, host: str, port: int, sni: str = "") -> bool:
-        """TLS 握手測試"""
-        try:
-            context = ssl.create_default_context()
-            context.check_hostname = False
-            context.verify_mode = ssl.CERT_NONE
-            
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(
-                    host, port,
-                    ssl=context,
-                    server_hostname=sni or host
-                ),
-                timeout=self.timeout
-            )
-            
-            writer.close()
-            await writer.wait_closed()
-            return True
-            
-        except Exception:
-            return False
+    async def sample_connection(self, ip: str, port: int, sni: str = "") -> ProbeResult:
+        """對同一目標間隔取樣多次 (DNS 已在快取、SSL context 共用)，返回統計結果
+        
+        尚未連上過的目標在連線被拒、或連續兩次失敗時停止取樣，避免死節點耗費多倍逾時時間；
+        單次逾時可能只是掉了一個 SYN，仍會再取一次樣本。
+        """
+        attempts = []
+        for i in range(self.samples):
+            if i:
+                await asyncio.sleep(self.sample_interval)
+            attempt = await self.test_connection(ip, port, sni)
+            attempts.append(attempt)
+            if not any(a.tcp_ok for a in attempts) and (attempt.refused or i >= 1):
+                break
+        
+        ok = [a for a in attempts if a.tcp_ok and (a.tls_ok or not sni)]
+        probe = ProbeResult(samples=len(attempts), loss_rate=round(1 - len(ok) / len(attempts), 3))
+        connected = [a.tcp_ms for a in attempts if a.tcp_ok]
+        if connected:
+            probe.tcp_ok = True
+            probe.min_ms, probe.tcp_ms, probe.p90_ms, probe.jitter_ms = latency_stats(connected)
+        handshakes = [a.tls_ms for a in attempts if a.tls_ok]
+        if handshakes:
+            probe.tls_ok = True
+            probe.tls_ms = int(statistics.median(handshakes))
+        return probe
+    
+    async def probe(self, ip: str, port: int, sni: str = "") -> tuple[ProbeResult, bool]:
+        """以 (ip, port, sni) 去重的連線測試；sni 為空表示只測 TCP
+        
+        返回 (結果, 是否由本次呼叫實際探測)；並發或之後的相同目標共用同一結果。
+        """
+        key = (ip, port, sni)
+        cached = self._probe_results.get(key)
+        if cached is not None:
+            self._probe_results.move_to_end(key)
+            return cached, False
+        return await self.probe_flight.execute(key, lambda: self._sample_and_cache(key))
+    
+    async def _sample_and_cache(self, key: tuple[str, int, str]) -> ProbeResult:
+        """實際探測，結果放入有上限的最近結果快取"""
+        probe = await self.sample_connection(*key)
+        self._probe_results[key] = probe
+        if len(self._probe_results) > self.PROBE_CACHE_SIZE:
+            self._probe_results.popitem(last=False)
+        return probe
+    
+    async def test_node(self, node: ProxyNode) -> TestResult:
+        """測試單個節點 (篩選後探測，不經過並發限制)"""
+        result, ip = await self.screen_node(node)
+        if ip:
+            await self.probe_node(node, ip, result)
+        return result
     
-    async def test_node(self, session: aiohttp.ClientSession, node: dict) -> TestResult:
-        """測試單個節點"""
-        result = TestResult(node_id=node.get("unique_id", ""))
+    async def screen_node(self, node: ProxyNode) -> tuple[TestResult, Optional[str]]:
+        """探測前的篩選：DNS、預掃描結果、過濾政策與 IP 情報
+        
+        返回 (結果, 要探測的 IP)；不需要探測 (無效、解析失敗、被排除) 時 IP 為 None。
+        這個階段可能在情報提供者的限速上等待，不佔用探測的並發名額。
+        """
+        result = TestResult(node_id=node.unique_id)
         
         try:
-            host = node.get("address", "")
-            port = node.get("port", 443)
+            host = node.address
+            port = node.port
             
             if not host or not port:
                 result.error = "Invalid host/port"
-                return result
+                return result, None
             
             # 解析 IP
-            ip = await self.resolve_host(host)
+            addrs, result.dns_ms = await self.resolver.resolve_timed(host)
+            ip = addrs[0] if addrs else None
             if not ip:
                 result.error = "DNS resolution failed"
-                return result
+                return result, None
+            
+            # 預掃描不可達的目標不必查詢 IP 情報與完整探測
+            if (ip, port) in self._unreachable:
+                result.prescanned = True
+                result.error = "TCP connection failed (prescan)"
+                return result, None
+            
+            # 過濾政策：在任何探測之前排除被封鎖的 IP
+            reason = self.policy.check_address(ip)
+            if not reason:
+                start = time.perf_counter()
+                ip_info = await self.ip_checker.check_ip(ip)
+                result.ip_lookup_ms = int((time.perf_counter() - start) * 1000)
+                result.ip_country = ip_info.get("country", "")
+                result.ip_score = ip_info.get("trust_score", 0)
+                if "error" in ip_info:
+                    # 無法評估的 IP 不算通過；不寫入歷史，下次執行重新查詢
+                    reason = f"intel {ip_info['error']}"
+                else:
+                    # 中國 IP 不適合 (用於翻牆)，同樣不必探測
+                    reason = self.policy.check_info(ip_info) or ("country CN" if result.ip_country == "CN" else None)
+            if reason:
+                self.block_stats[reason.split()[0]] += 1
+                result.blocked = True
+                result.error = f"Blocked: {reason}"
+                return result, None
+            return result, ip
+        
+        except Exception as e:
+            result.error = str(e)
+            return result, None
+    
+    async def probe_node(self, node: ProxyNode, ip: str, result: TestResult):
+        """探測已通過篩選的節點，把連線結果填入 result"""
+        try:
+            host = node.address
+            port = node.port
             
-            # TCP 測試
-            tcp_ok, latency = await self.test_tcp(ip, port)
-            result.tcp_ok = tcp_ok
-            result.latency_ms = latency
+            # TCP + TLS 測試 (節點使用 TLS 時在同一連線上握手)
+            sni = (node.sni or host) if node.tls else ""
+            probe, result.measured = await self.probe(ip, port, sni)
+            result.tcp_ok = probe.tcp_ok
+            result.latency_ms = probe.tcp_ms
+            result.latency_min_ms = probe.min_ms
+            result.latency_p90_ms = probe.p90_ms
+            result.jitter_ms = probe.jitter_ms
+            result.loss_rate = probe.loss_rate
+            result.samples = probe.samples
             
-            if not tcp_ok:
+            if not probe.tcp_ok:
                 result.error = "TCP connection failed"
-                return result
+                return
             
-            # TLS 測試 (如果節點使用 TLS)
-            if node.get("tls", False):
-                sni = node.get("sni", "") or host
-                result.tls_ok = await self.test_tls(ip, port, sni)
+            if node.tls:
+                result.tls_ok = probe.tls_ok
+                result.tls_ms = probe.tls_ms
             else:
                 result.tls_ok = True
-            
-            # IP 純淨度檢測
-            ip_info = await self.ip_checker.check_ip(session, ip)
-            result.ip_info = ip_info
-            result.ip_score = ip_info.get("trust_score", 50)
+                result.tls_ms = 0
             
             # 判斷中國友好度
-            # 低延遲 + 乾淨 IP + 非中國 = 好節點
+            # 低延遲 (中位數，不受單次抖動影響) + 乾淨 IP (已通過過濾政策) = 好節點
             result.china_friendly = (
                 result.tcp_ok and
                 result.latency_ms < 500 and
-                result.ip_score >= 30 and
-                ip_info.get("country", "") != "CN"
+                result.ip_score >= self.policy.min_trust_score
             )
             
         except Exception as e:
             result.error = str(e)
-        
+    
+    def _new_limiter(self) -> AdaptiveLimiter:
+        """依設定建立並發限制器；adaptive 為 false 時固定為 max_concurrent"""
+        config = self.concurrency_config
+        return AdaptiveLimiter(
+            initial=self.max_concurrent,
+            minimum=config.get("min", 10),
+            maximum=config.get("max", 500),
+            window=config.get("window", 50),
+            step=config.get("step", 5),
+            backoff=config.get("backoff", 0.75),
+            latency_tolerance=config.get("latency_tolerance", 1.5),
+            error_margin=config.get("error_margin", 0.15),
+            adaptive=config.get("adaptive", True)
+        )
+    
+    async def _limited_test(self, limiter: AdaptiveLimiter, node: ProxyNode,
+                            writer: Optional[NDJSONWriter]) -> TestResult:
+        """篩選 (DNS、過濾政策、IP 情報) 不佔並發名額，只有探測在限制下進行；
+        實際探測的連線延遲回報給限制器，通過時立即寫入結果文件"""
+        result, ip = await self.screen_node(node)
+        if ip:
+            async with limiter:
+                await self.probe_node(node, ip, result)
+                if result.measured:
+                    limiter.record(result.latency_ms if result.tcp_ok else None, result.tcp_ok)
+        if writer and result.china_friendly:
+            writer.write(self.result_record(node, result))
         return result
     
-    async def test_all(self, nodes: list[dict]) -> list[dict]:
-        """測試所有節點"""
-        print(f"🦐 開始測試 {len(nodes)} 個節點...\n")
-        
-        # 限制並發
-        semaphore = asyncio.Semaphore(self.max_concurrent)
-        
-        async def limited_test(session, node):
-            async with semaphore:
-                return await self.test_node(session, node)
-        
-        async with aiohttp.ClientSession() as session:
-            tasks = [limited_test(session, node) for node in nodes]
-            results = await asyncio.gather(*tasks)
-        
-        # 統計結果
-        passed = 0
-        tested_nodes = []
-        
-        for node, result in zip(nodes, results):
-            node["test_result"] = {
-                "tcp_ok": result.tcp_ok,
-                "tls_ok": result.tls_ok,
-                "latency_ms": result.latency_ms,
-                "ip_score": result.ip_score,
-                "china_friendly": result.china_friendly,
-                "ip_country": result.ip_info.get("country", "") if result.ip_info else "",
-                "error": result.error
-            }
-            
-            if result.china_friendly:
-                passed += 1
-                tested_nodes.append(node)
+    async def _run_node(self, limiter: AdaptiveLimiter, node: ProxyNode,
+                        writer: Optional[NDJSONWriter]) -> TestResult:
+        """依測試歷史決定探測、沿用上次結果或略過，探測結果寫回歷史"""
+        if self.history:
+            plan, entry = self.history.plan(node.unique_id)
+            if plan == REUSE:
+                data = json.loads(entry.last_result)
+                # 只沿用在目前過濾政策下得到的結果；政策變更 (例如新增封鎖國家、提高信任分數門檻) 後重新測試
+                if data.get("policy") == self.policy.fingerprint:
+                    self.history_stats[REUSE] += 1
+                    result = TestResult.from_dict(node.unique_id, data)
+                    if writer and result.china_friendly:
+                        writer.write(self.result_record(node, result))
+                    return result
+                self.history_stats["policy_changed"] += 1
+            if plan == SKIP:
+                self.history_stats[SKIP] += 1
+                return TestResult(node_id=node.unique_id, error=f"Skipped: {entry.fail_streak} consecutive failures")
         
+        result = await self._limited_test(limiter, node, writer)
+        # 預掃描排除的節點未實際探測，不計入歷史 (避免單次掃描失敗累積成 SKIP)
+        if self.history and not result.blocked and not result.prescanned:
+            passed = result.china_friendly
+            self.history.record(
+                node.unique_id, passed,
+                result.latency_ms if result.tcp_ok else None,
+                result.error,
+                json.dumps(dict(result.to_dict(), policy=self.policy.fingerprint)) if passed else None
+            )
+        return result
+    
+    @staticmethod
+    def result_record(node: ProxyNode, result: TestResult) -> dict:
+        """測試通過節點的保存格式"""
+        return dict(node.to_dict(), test_result=result.to_dict())
+    
+    def _summarize(self, passed: int, total: int,
+                   writer: Optional[NDJSONWriter] = None,
+                   limiter: Optional[AdaptiveLimiter] = None):
+        """輸出統計並關閉結果文件"""
         print(f"\n測試完成:")
         print(f"  ✓ 通過: {passed}")
-        print(f"  ✗ 失敗: {len(nodes) - passed}")
+        print(f"  ✗ 失敗: {total - passed}")
+        print(f"  🔁 探測目標: {self.probe_flight.executed} 個 (共 {total} 個節點)")
+        
+        stats = {"passed": passed, "failed": total - passed}
+        if self._unreachable:
+            stats["prescan_unreachable"] = len(self._unreachable)
+            print(f"  📡 預掃描不可達: {stats['prescan_unreachable']} 個目標")
+        if self.history:
+            stats["reused"] = self.history_stats[REUSE]
+            stats["skipped"] = self.history_stats[SKIP]
+            stats["policy_changed"] = self.history_stats["policy_changed"]
+            print(f"  ♻ 沿用上次結果: {stats['reused']} / 略過穩定失敗: {stats['skipped']} / "
+                  f"政策變更重測: {stats['policy_changed']}")
+        if self.block_stats:
+            stats["blocked"] = dict(self.block_stats)
+            print(f"  ⛔ 政策排除: {sum(self.block_stats.values())} "
+                  f"({', '.join(f'{k} {v}' for k, v in self.block_stats.most_common())})")
+        print(f"  🔗 合併並發查詢: DNS {self.resolver.flight.coalesced} / IP {self.ip_checker.flight.coalesced}")
+        ip_stats = self.ip_checker.stats
+        if ip_stats:
+            stats["ip_intel"] = dict(ip_stats)
+            print(f"  🛰 IP 情報: 快取 {ip_stats['cached']} / 推斷 {ip_stats['inferred']} / "
+                  f"過期沿用 {ip_stats['stale']} / 查詢 {ip_stats['lookup']} (失敗 {ip_stats['failed']})")
+            if self.ip_checker.all_failed:
+                # 情報全部失敗時所有節點都被排除，合併階段據此保留上次的訂閱
+                stats["intel_outage"] = True
+                print("  ⚠ 所有 IP 情報查詢都失敗，本次結果不可用")
+        if limiter:
+            stats["concurrency"] = limiter.stats()
+            print(f"  ⚙ 並發: 最終 {limiter.limit} / 最高 {limiter.peak} (調整 {limiter.adjustments} 次)")
+        
+        if writer:
+            writer.close(**stats)
+    
+    async def _consume(self, queue: asyncio.Queue, writer: Optional[NDJSONWriter]) -> list[TestedNode]:
+        """固定數量的 worker 從佇列取節點測試，收到 None 後結束
+        
+        提供 writer 時通過的結果直接寫出、不在記憶體中保留 (返回空列表)；
+        否則返回通過的節點 (不排序；排序與截斷由合併階段的 top-K 處理)。
+        """
+        tested_nodes: list[TestedNode] = []
+        total = passed = 0
+        limiter = self._new_limiter()
+        self.probe_flight = SingleFlight()
+        self._probe_results.clear()
+        self.history_stats.clear()
+        self.block_stats.clear()
         
-        # 按延遲排序
-        tested_nodes.sort(key=lambda x: x["test_result"]["latency_ms"])
+        async def worker():
+            nonlocal total, passed
+            while True:
+                node = await queue.get()
+                if node is None:
+                    # 放回結束標記，讓其他 worker 也能結束
+                    queue.put_nowait(None)
+                    return
+                result = await self._run_node(limiter, node, writer)
+                total += 1
+                if result.china_friendly:
+                    passed += 1
+                    if writer is None:
+                        tested_nodes.append((node, result))
         
+        # worker 數量取上限，實際並發由限制器決定
+        await asyncio.gather(*(worker() for _ in range(limiter.maximum)))
+        
+        # 保存本輪的快取與歷史；連線在 close() 時才關閉，同一個測試器可以再次執行
+        self.resolver.save()
+        if self.ip_checker.store:
+            self.ip_checker.store.save()
+        if self.history:
+            self.history.flush()
+            self.history.unload()
+        self._summarize(passed, total, writer, limiter)
         return tested_nodes
     
-    def save_results(self, nodes: list[dict], output_path: str = "output/tested_nodes.json"):
-        """保存測試結果"""
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    async def test_all(self, nodes: Iterable[ProxyNode], writer: Optional[NDJSONWriter] = None) -> list[TestedNode]:
+        """測試所有節點；提供 writer 時每個通過的結果完成後立即寫出，不再另外返回
         
-        data = {
-            "count": len(nodes),
-            "updated": __import__('datetime').datetime.utcnow().isoformat() + "Z",
-            "nodes": nodes
-        }
+        nodes 可以是惰性迭代器，經由有界佇列餵給 worker，記憶體只與並發數成正比。
+        傳入列表時會先批次解析所有主機名，並依測試歷史把新節點與不穩定節點排在前面。
+        """
+        # 上一輪的預掃描結果不沿用：本輪未預掃描時不應以舊結果排除目標
+        self._unreachable = set()
+        if isinstance(nodes, Sequence):
+            print(f"🦐 開始測試 {len(nodes)} 個節點...\n")
+            if self.history:
+                self.history.preload(node.unique_id for node in nodes)
+                nodes = sorted(nodes, key=lambda node: self.history.priority(node.unique_id))
+            await self.warm_dns(nodes)
+            if self.scanner and len(nodes) >= self.scan_min_nodes:
+                await self.prescan(nodes)
+        else:
+            print(f"🦐 開始測試...\n")
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        
+        async def feed():
+            for node in nodes:
+                await queue.put(node)
+            await queue.put(None)
+        
+        feeder = asyncio.create_task(feed())
+        try:
+            return await self._consume(queue, writer)
+        finally:
+            feeder.cancel()
+    
+    async def test_stream(self, queue: asyncio.Queue, writer: Optional[NDJSONWriter] = None) -> list[TestedNode]:
+        """從佇列取出節點即時測試，收到 None 後結束 (與聚合並行執行)"""
+        print(f"🦐 開始測試 (並發 {self.max_concurrent})...\n")
+        self._unreachable = set()
+        return await self._consume(queue, writer)
+    
+    async def close(self):
+        """關閉解析器、IP 情報客戶端與測試歷史 (保存各自的快取)"""
+        await self.resolver.close()
+        await self.ip_checker.close()
+        if self.history:
+            self.history.close()
+    
+    def save_results(self, nodes: list[TestedNode], output_path: str = TESTED_NODES_PATH):
+        """保存測試結果 (NDJSON)"""
+        with NDJSONWriter(output_path, "tested", flush_every=1000) as writer:
+            for node, result in nodes:
+                writer.write(self.result_record(node, result))
         
         print(f"✓ 測試結果已保存到 {output_path}")
+    
+    def open_results(self, output_path: str = TESTED_NODES_PATH) -> NDJSONWriter:
+        """開啟結果文件，供測試過程中逐筆寫入"""
+        return NDJSONWriter(output_path, "tested")
 
 
 async def main():
     # 載入原始節點
-    with open("output/raw_nodes.json", 'r') as f:
-        data = json.load(f)
-    
-    nodes = data.get("nodes", [])
+    nodes = [ProxyNode.from_dict(n) for n in iter_records(RAW_NODES_PATH)]
     
-    # 測試節點
+    # 測試節點，通過的結果即時寫入
     tester = NodeTester()
-    passed_nodes = await tester.test_all(nodes)
-    
-    # 保存結果
-    tester.save_results(passed_nodes)
+    writer = tester.open_results()
+    try:
+        await tester.test_all(nodes, writer)
+    finally:
+        writer.close()
+        await tester.close()
+    print(f"✓ 測試結果已保存到 {writer.path}")
 
 
 if __name__ == "__main__":
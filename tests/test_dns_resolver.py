@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+原生 DNS 客戶端測試 - 對另一個進程中的本地替身 DNS 伺服器發出大量並發查詢
+
+執行: python -m unittest discover tests
+"""
+
+import sys
+import time
+import socket
+import struct
+import asyncio
+import tempfile
+import unittest
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from dns_resolver import AsyncResolver, _read_name, read_hosts  # noqa: E402
+
+NEGATIVE_TTL = 60
+
+
+def answer(data: bytes) -> bytes:
+    """替身伺服器：hN.test 返回 A 10.0.x.y，其他名稱 NXDOMAIN (附 SOA)"""
+    qid = struct.unpack_from("!H", data)[0]
+    name, offset = _read_name(data, 12)
+    qtype = struct.unpack_from("!H", data, offset)[0]
+    question = data[12:offset + 4]
+    answers = b""
+    count = 0
+    rcode = 3
+    if name.startswith("h") and name.endswith(".test"):
+        rcode = 0
+        if qtype == 1:
+            index = int(name[1:-5])
+            rdata = socket.inet_aton(f"10.0.{index // 256}.{index % 256}")
+            answers = b"\xc0\x0c" + struct.pack("!HHIH", 1, 1, 120, 4) + rdata
+            count = 1
+    authority = b""
+    if not count:
+        soa = b"\x00\x00" + struct.pack("!IIIII", 1, 2, 3, 4, NEGATIVE_TTL)
+        authority = b"\x00" + struct.pack("!HHIH", 6, 1, 300, len(soa)) + soa
+    header = struct.pack("!HHHHHH", qid, 0x8180 | rcode, 1, count, 1 if authority else 0, 0)
+    return header + question + answers + authority
+
+
+def serve(port, ready):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    sock.bind(("127.0.0.1", 0))
+    port.value = sock.getsockname()[1]
+    ready.set()
+    while True:
+        data, addr = sock.recvfrom(2048)
+        sock.sendto(answer(data), addr)
+
+
+class AsyncResolverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.port = multiprocessing.Value("i", 0)
+        ready = multiprocessing.Event()
+        cls.server = multiprocessing.Process(target=serve, args=(cls.port, ready), daemon=True)
+        cls.server.start()
+        ready.wait(5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.join()
+
+    def resolver(self, **kwargs) -> AsyncResolver:
+        return AsyncResolver([f"127.0.0.1:{self.port.value}"], timeout=2, retries=0, hosts_file=None, **kwargs)
+
+    def test_burst_without_timeouts(self):
+        """1000 個主機名 (2000 個查詢) 同時發出，不應因接收緩衝區溢出而逾時"""
+        async def run():
+            resolver = self.resolver()
+            try:
+                return await asyncio.gather(
+                    *(resolver.resolve(f"h{i}.test") for i in range(1000)),
+                    return_exceptions=True
+                )
+            finally:
+                await resolver.close()
+
+        results = asyncio.run(run())
+        failures = [r for r in results if isinstance(r, Exception)]
+        self.assertEqual(failures, [])
+        self.assertEqual(results[257], (["10.0.1.1"], 120))
+
+    def test_nxdomain_uses_soa_ttl(self):
+        async def run():
+            resolver = self.resolver()
+            try:
+                return await resolver.resolve("missing.example")
+            finally:
+                await resolver.close()
+
+        self.assertEqual(asyncio.run(run()), ([], NEGATIVE_TTL))
+
+    def test_hosts_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".hosts", delete=False) as f:
+            f.write("127.0.0.1 localhost  # loopback\n::1 localhost ip6-localhost\nbogus line\n")
+        self.assertEqual(read_hosts(f.name)["localhost"], ["127.0.0.1", "::1"])
+
+        async def run():
+            resolver = AsyncResolver(["127.0.0.1:9"], timeout=0.2, retries=0, hosts_file=f.name)
+            try:
+                return await resolver.resolve("LOCALHOST.")
+            finally:
+                await resolver.close()
+
+        self.assertEqual(asyncio.run(run())[0], ["127.0.0.1", "::1"])
+        Path(f.name).unlink()
+
+
+if __name__ == "__main__":
+    unittest.main()